@@ -1,43 +1,187 @@
 # FILE: src/agent.py
-# V8.2 (Final Polish): Includes a corrected JSON parser and final presentation logic.
+# V8.18 (Rank-Ordered Evidence): Evidence keeps the re-ranker order in the prompt, the [n] numbering and the references; the V8.7 hash sort is gone.
+# V8.17 (Speculative Vector Search): When the graph is tried first, vector search runs alongside it and is only awaited if the graph comes back empty.
+# V8.16 (Batched Sub-Question Embeddings): A decomposed query embeds all retrieval steps in one call, overlapped with their classification.
+# V8.15 (Re-ranker Instruction): The Gemini re-ranker's rules and example are its system instruction; calls carry only the task.
+# V8.14 (Single-Observation Fast Path): A plan with one retrieval step is answered by direct synthesis alone.
+# V8.13 (Batched Sub-Answers): Sub-questions of a decomposed query share one synthesis call over their pooled evidence.
+# V8.12 (Compact Re-ranking Input): The Gemini re-ranker sees evidence text only, without citation HTML.
+# V8.11 (Planner Join): The planner's `join` instruction drives the final synthesis of a multi-step plan.
+# V8.10 (JSON Scratchpad): Sub-answers reach the reasoning synthesis as compact {sub_q, answer, citations} JSON.
+# V8.9 (Map-Reduce Summaries): Long summary evidence is condensed block by block before the final summary call.
+# V8.8 (Warm Start): Local encoders are loaded and exercised on a background thread when the agent is built.
+# V8.7 (Canonical Evidence Order): Snippets are sorted by a content hash before synthesis, so the
+# same evidence set always renders the same prompt regardless of retrieval order.
+# V8.6 (Local Re-ranking): Snippets are scored by a local cross-encoder; the Gemini re-ranker is the fallback.
+# V8.5 (Fused Planning): One structured Gemini call classifies and decomposes the query.
+# V8.4 (Response Cache): Re-ranking and single-step synthesis results are cached per
+# (question, evidence), so repeated or paraphrased questions over the same evidence skip the LLM.
+# V8.3 (Streaming): Final synthesis is streamed token-by-token so the UI can render
+# the answer as soon as the first chunk arrives.
 
 import json
 import logging
 import time
 import re
+import threading
 from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from concurrent.futures import ThreadPoolExecutor
 
-from src.tools.clients import get_generative_model, get_flash_model, DEFAULT_REQUEST_OPTIONS
-from src.models import ToolResult, QueryMetadata, ToolPlanItem
-from src.planner.query_classifier import QueryClassifier
+from src.tools.clients import get_generative_model, get_flash_model, get_instructed_flash_model, get_cross_encoder, get_sentence_encoder, DEFAULT_REQUEST_OPTIONS
+from src.models import ToolResult, QueryMetadata, ToolPlanItem, TraceRecord
+from src.planner.query_classifier import get_query_classifier
 from src.planner.tool_planner import ToolPlanner
-from src.planner.persona_classifier import PersonaClassifier
-from src.planner.query_rewriter import QueryRewriter
+from src.planner.persona_classifier import get_persona_classifier
+from src.planner.query_rewriter import get_query_rewriter
 from src.router.tool_router import ToolRouter
-from src.prompts import DECOMPOSITION_PROMPT, REASONING_SYNTHESIS_PROMPT, DIRECT_SYNTHESIS_PROMPT, RERANKING_PROMPT, SUMMARIZATION_PROMPT
+from src.tools.retrievers import prefetch_query_embeddings
+from src.common.trace_writer import TraceWriter
+from src.common.response_cache import ResponseCache
+from src.common.disk_cache import make_cache_key
+from src.prompts import render_reasoning_synthesis, render_direct_synthesis, render_reranking, render_summarization, render_map_summary, render_batch_answer, RERANKING_SYSTEM_INSTRUCTION
 
 logger = logging.getLogger(__name__)
 LOG_PATH = Path("trace_logs.jsonl")
+_trace_writer = TraceWriter(LOG_PATH)
+FLASH_MODEL = 'gemini-1.5-flash-latest'
+PRO_MODEL = 'gemini-1.5-pro-latest'
+# Synthesis model per query intent. Lookups and summaries are short, evidence-bound answers that
+# Flash handles well; only comparisons, which reason across sub-answers, get the Pro model.
+MODEL_ROUTING = {
+    "specific_fact_lookup": FLASH_MODEL,
+    "simple_summary": FLASH_MODEL,
+    "general_qa": FLASH_MODEL,
+    "comparative_analysis": PRO_MODEL,
+}
 
-# --- DEFINITIVE FIX: Robust JSON Parser that handles objects AND arrays ---
-def extract_json_from_response(text: str) -> dict | list:
-    """Finds and parses the first valid JSON object or array from a string."""
-    # Regex to find JSON wrapped in markdown, supporting both objects {} and arrays []
-    match = re.search(r'```json\s*([\[\{].*?[\]\}])\s*```', text, re.DOTALL)
-    if match:
-        try:
-            return json.loads(match.group(1))
-        except json.JSONDecodeError:
-            pass
+_EVIDENCE_LABEL_RE = re.compile(r"^Evidence from (?:document|graph|graph path): ")
+# Label of a single-hop graph row, the only kind of evidence that can stand as the answer on its own.
+_SINGLE_HOP_LABEL = "Evidence from graph: "
+# Shared across sessions. Keys include the evidence, so a cached answer is never reused for different documents.
+_rerank_cache = ResponseCache("reranker")
+_synthesis_cache = ResponseCache("synthesis")
+
+# The re-ranker answers with a short JSON array of document indices. Constraining it server-side
+# removes fenced or chatty replies, and the token cap bounds decode time for at most 5 indices.
+RERANK_MAX_RESULTS = 5
+# Cross-encoder scores (sigmoid of the relevance logit) below this are treated as not relevant.
+CROSS_ENCODER_MIN_SCORE = 0.05
+RERANK_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {"type": "array", "items": {"type": "integer"}},
+    "max_output_tokens": 32,
+    "temperature": 0.0,
+}
+# Decomposed sub-questions are answered together; the schema guarantees one string per question.
+BATCH_ANSWER_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {"type": "array", "items": {"type": "string"}},
+    "temperature": 0.0,
+}
+# Summary evidence longer than this is first condensed per block (map) and then summarized (reduce).
+# Below it a single call over the raw evidence is cheaper than the extra round trip.
+SUMMARY_MAP_THRESHOLD_CHARS = 12000
+SUMMARY_MAP_BLOCK_CHARS = 4000
+MAP_SUMMARY_GENERATION_CONFIG = {"max_output_tokens": 160, "temperature": 0.0}
+
+# Typical questions encoded once at startup. The first encode call pays for model load, tokenizer
+# setup and kernel initialization; doing it off the request path keeps it out of the first user's latency.
+WARMUP_QUERIES = (
+    "What is Amivantamab used to treat?",
+    "Who is the sponsor for Abaloparatide?",
+    "Summarize the outcomes of the March 2025 PBAC meeting.",
+    "Compare the submission purposes for Acalabrutinib and Alectinib.",
+)
+
+
+def _warm_up_local_models() -> None:
+    """Loads the sentence encoder and cross-encoder and runs one batch through each. Failures are only logged."""
     try:
-        # Fallback to parsing the entire string
-        return json.loads(text)
-    except json.JSONDecodeError:
-        logger.warning(f"Could not parse JSON from response text: {text}")
-        return {} # Return empty dict on failure
+        with Timer("Local model warm-up"):
+            encoder = get_sentence_encoder()
+            if encoder is not None:
+                encoder.encode([" ".join(q.lower().split()) for q in WARMUP_QUERIES], normalize_embeddings=True, convert_to_numpy=True)
+            cross_encoder = get_cross_encoder()
+            if cross_encoder is not None:
+                cross_encoder.predict([(q, q) for q in WARMUP_QUERIES], convert_to_numpy=True)
+    except Exception as e:
+        logger.warning(f"Local model warm-up failed: {e}")
+
+
+def _evidence_text(doc: str) -> str:
+    """The snippet text without its citation line or retriever label."""
+    return _EVIDENCE_LABEL_RE.sub("", doc.split("\nCitation: ")[0], count=1)
+
+
+def _split_into_blocks(lines: List[str], max_chars: int) -> List[str]:
+    """Groups evidence lines into blocks of at most `max_chars`; a single longer line forms its own block."""
+    blocks, current, size = [], [], 0
+    for line in lines:
+        if current and size + len(line) > max_chars:
+            blocks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+_REFERENCES_HEADER = "\n\n**References**\n"
+
+
+class _Retrieval(NamedTuple):
+    docs: List[str]
+    kg_success: bool
+    query_meta: Optional[QueryMetadata]
+    tool_plan: List[ToolPlanItem]
+    tool_results: List[ToolResult]
+    failure: Optional[str]
+
+
+def _split_evidence(docs: List[str]) -> Tuple[List[str], List[str]]:
+    """Separates snippet text from citation links, keeping the re-ranker's order.
+
+    The model reads the most relevant snippet first, and the [n] numbers in the answer, the
+    references and the cache key all follow that same order.
+    """
+    evidence_texts, citation_links = [], []
+    for doc in docs:
+        parts = doc.split("\nCitation: ")
+        evidence_texts.append(parts[0])
+        if len(parts) > 1:
+            citation_links.append(parts[1])
+    return evidence_texts, citation_links
+
+
+def _number_evidence(evidence_texts: List[str]) -> str:
+    """One "[N] text" line per snippet: the retriever's "Evidence from ...:" labels and block
+    headers cost tokens on every call without helping the model cite."""
+    return "\n".join([f"[{i+1}] {_EVIDENCE_LABEL_RE.sub('', text, count=1)}" for i, text in enumerate(evidence_texts)])
+
+
+def _cited_links(answer_text: str, citation_links: List[str]) -> List[str]:
+    """The distinct links for the evidence numbers cited in the answer, in evidence order."""
+    used_indices = {int(m) - 1 for m in re.findall(r'\[(\d+)\]', answer_text)}
+    unique_used_links = set()
+    used_links_ordered = []
+    for idx in sorted(list(used_indices)):
+        if idx < len(citation_links):
+            link = citation_links[idx]
+            if link not in unique_used_links:
+                unique_used_links.add(link)
+                used_links_ordered.append(link)
+    return used_links_ordered
+
+
+def _format_references(answer_text: str, citation_links: List[str]) -> str:
+    """Builds the References section for the evidence numbers cited in the answer; empty if none were cited."""
+    used_links_ordered = _cited_links(answer_text, citation_links)
+    if not used_links_ordered:
+        return ""
+    return _REFERENCES_HEADER + "\n".join([f"{i+1}. {link}" for i, link in enumerate(used_links_ordered)])
 
 
 class Timer:
@@ -46,68 +190,111 @@ class Timer:
     def __exit__(self, *args): self.end = time.perf_counter(); logger.info(f"[TIMER] {self.name} took {(self.end - self.start) * 1000:.2f} ms")
 
 def log_trace(query: str, persona: str, query_meta: QueryMetadata, tool_plan: List[ToolPlanItem], tool_results: List[ToolResult], final_answer: str, total_latency_sec: float):
-    trace_record = { "timestamp": datetime.utcnow().isoformat() + "Z", "query": query, "persona": persona, "intent": query_meta.intent if query_meta else "classification_failed", "graph_suitable": query_meta.question_is_graph_suitable if query_meta else "unknown", "tool_plan": [t.model_dump() for t in tool_plan] if tool_plan else [], "tool_results": [r.model_dump() for r in tool_results] if tool_results else [], "final_answer_preview": final_answer[:200] + "..." if final_answer else "N/A", "total_latency_sec": round(total_latency_sec, 3) }
-    try:
-        with open(LOG_PATH, "a", encoding="utf-8") as f: f.write(json.dumps(trace_record) + "\n")
-    except Exception as e:
-        logger.error(f"Failed to write to trace log: {e}", exc_info=True)
+    trace_record = TraceRecord(
+        timestamp=datetime.utcnow().isoformat() + "Z",
+        query=query,
+        persona=persona,
+        intent=query_meta.intent if query_meta else "classification_failed",
+        graph_suitable=query_meta.question_is_graph_suitable if query_meta else "unknown",
+        tool_plan=tool_plan or [],
+        tool_results=tool_results or [],
+        final_answer_preview=final_answer[:200] + "..." if final_answer else "N/A",
+        total_latency_sec=round(total_latency_sec, 3),
+    )
+    # The file append happens on the background writer thread, off the request path.
+    _trace_writer.submit(trace_record)
 
 
 class Agent:
     def __init__(self, confidence_threshold: float = 0.85):
-        self.classifier = QueryClassifier()
+        self.classifier = get_query_classifier()
         self.planner = ToolPlanner(coverage_threshold=confidence_threshold)
         self.router = ToolRouter()
-        self.persona_classifier = PersonaClassifier()
-        self.rewriter = QueryRewriter()
-        self.llm = get_generative_model('gemini-1.5-pro-latest')
-        self.synthesis_llm = get_flash_model('gemini-1.5-flash-latest')
-        self.reranker_llm = get_flash_model('gemini-1.5-flash-latest')
+        self.persona_classifier = get_persona_classifier()
+        self.rewriter = get_query_rewriter()
+        self.llm = get_generative_model(PRO_MODEL)
+        self.synthesis_llm = get_flash_model(FLASH_MODEL)
+        self.reranker_llm = get_instructed_flash_model(RERANKING_SYSTEM_INSTRUCTION, FLASH_MODEL)
+        threading.Thread(target=_warm_up_local_models, name="model-warmup", daemon=True).start()
+
+    def _rerank(self, query: str, documents: List[str]) -> List[str]:
+        """Re-ranks with the local cross-encoder when it is installed, otherwise with Gemini."""
+        if not documents: return documents
+        cross_encoder = get_cross_encoder()
+        if cross_encoder is None:
+            return self._rerank_with_gemini(query, documents)
+        try:
+            with Timer("Re-ranking with cross-encoder"):
+                # Score the evidence text only; the citation HTML carries no relevance signal.
+                pairs = [(query, doc.split("\nCitation: ")[0]) for doc in documents]
+                scores = cross_encoder.predict(pairs, batch_size=32, convert_to_numpy=True)
+                ranked = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+                reranked_docs = [documents[i] for i in ranked[:RERANK_MAX_RESULTS] if scores[i] >= CROSS_ENCODER_MIN_SCORE]
+            logger.info(f"Re-ranked {len(documents)} snippets down to {len(reranked_docs)} using the cross-encoder.")
+            return reranked_docs
+        except Exception as e:
+            logger.error(f"Cross-encoder re-ranking failed: {e}. Falling back to Gemini.", exc_info=False)
+            return self._rerank_with_gemini(query, documents)
 
     def _rerank_with_gemini(self, query: str, documents: List[str]) -> List[str]:
         if not self.reranker_llm or not documents: return documents
-        formatted_docs = "\n\n".join([f"DOCUMENT[{i}]:\n{doc}" for i, doc in enumerate(documents)])
-        prompt = RERANKING_PROMPT.format(question=query, documents=formatted_docs)
+        docs_key = make_cache_key(*documents)
+        cached_indices = _rerank_cache.get(query, docs_key)
+        if cached_indices is not None:
+            return [documents[i] for i in json.loads(cached_indices) if 0 <= i < len(documents)]
+        # Citation HTML and the "Evidence from ...:" label carry no relevance signal, only tokens.
+        formatted_docs = "\n".join([f"DOCUMENT[{i}]: {_evidence_text(doc)}" for i, doc in enumerate(documents)])
+        prompt = render_reranking(question=query, documents=formatted_docs)
         try:
             with Timer("Re-ranking with Gemini"):
-                response = self.reranker_llm.generate_content(prompt, request_options=DEFAULT_REQUEST_OPTIONS)
-                best_indices = extract_json_from_response(response.text)
+                response = self.reranker_llm.generate_content(prompt, generation_config=RERANK_GENERATION_CONFIG, request_options=DEFAULT_REQUEST_OPTIONS)
+                best_indices = json.loads(response.text)
                 if not isinstance(best_indices, list):
                     logger.warning("Gemini re-ranker did not return a list. Falling back.")
-                    return documents[:5]
-                reranked_docs = [documents[i] for i in best_indices if i < len(documents)]
+                    return documents[:RERANK_MAX_RESULTS]
+                best_indices = list(dict.fromkeys(i for i in best_indices if isinstance(i, int) and 0 <= i < len(documents)))[:RERANK_MAX_RESULTS]
+                _rerank_cache.put(query, docs_key, json.dumps(best_indices))
+                reranked_docs = [documents[i] for i in best_indices]
                 logger.info(f"Re-ranked {len(documents)} snippets down to {len(reranked_docs)} using Gemini.")
                 return reranked_docs
         except Exception as e:
-            logger.error(f"Gemini re-ranking failed: {e}. Falling back to top 5.", exc_info=False)
-            return documents[:5]
+            logger.error(f"Gemini re-ranking failed: {e}. Falling back to top {RERANK_MAX_RESULTS}.", exc_info=False)
+            return documents[:RERANK_MAX_RESULTS]
 
-    def _run_single_rag_step(self, query: str, persona: str) -> Tuple[str, QueryMetadata, List[ToolPlanItem], List[ToolResult]]:
-        with Timer(f"Single RAG Step for '{query[:30]}...'"):
-            query_meta = self.classifier.classify(query)
-            if not query_meta: return "I had trouble understanding the query.", None, [], []
+    def _retrieve(self, query: str, persona: str, query_meta: Optional[QueryMetadata] = None) -> _Retrieval:
+        """Classifies (if needed), runs the planned tools and re-ranks. `failure` holds the user-facing message when nothing usable was found."""
+        with Timer(f"Retrieval for '{query[:30]}...'"):
+            if query_meta is None:
+                query_meta = self.classifier.classify(query)
+            if not query_meta: return _Retrieval([], False, None, [], [], "I had trouble understanding the query.")
 
             tool_plan = self.planner.plan(query_meta, persona)
-            if not tool_plan: return "I don't have a strategy for this query.", query_meta, [], []
+            if not tool_plan: return _Retrieval([], False, query_meta, [], [], "I don't have a strategy for this query.")
 
             # --- START OF DEFINITIVE FIX: Intelligent Tool Flow ---
             
             # Prioritize the Knowledge Graph if it's suitable and planned
             final_results = []
             kg_success = False
+            wants_vector = any(t.tool_name == "vector_search" for t in tool_plan)
+            vector_future = None
             if query_meta.question_is_graph_suitable and any(t.tool_name == "query_knowledge_graph" for t in tool_plan):
+                # Vector search starts alongside the graph so a graph miss costs max(latencies), not their sum.
+                if wants_vector:
+                    vector_future = self.router.submit_tool("vector_search", query, query_meta)
                 kg_result = self.router.execute_tool("query_knowledge_graph", query, query_meta)
                 final_results.append(kg_result)
                 # If the KG finds a definitive answer, we can often stop here.
                 if kg_result.success and kg_result.content.strip():
                     logger.info("Knowledge Graph provided a definitive answer. Bypassing vector search and re-ranking.")
                     kg_success = True
+                    if vector_future:
+                        vector_future.cancel()
 
-            # Run vector search only if the KG failed or wasn't suitable
-            if not kg_success:
-                if any(t.tool_name == "vector_search" for t in tool_plan):
-                    vector_result = self.router.execute_tool("vector_search", query, query_meta)
-                    final_results.append(vector_result)
+            # Use vector search only if the KG failed or wasn't suitable
+            if not kg_success and wants_vector:
+                vector_result = vector_future.result() if vector_future else self.router.execute_tool("vector_search", query, query_meta)
+                final_results.append(vector_result)
 
             # --- END OF DEFINITIVE FIX ---
 
@@ -117,79 +304,160 @@ class Agent:
                     all_docs.extend(res.content.split("\n---\n"))
 
             if not all_docs:
-                return "I searched but could not find any relevant details.", query_meta, tool_plan, final_results
+                return _Retrieval([], False, query_meta, tool_plan, final_results, "I searched but could not find any relevant details.")
 
             # --- START OF DEFINITIVE FIX: Conditional Re-ranking ---
             # Only re-rank if we didn't get a golden answer from the KG
             if not kg_success:
-                ranked_docs = self._rerank_with_gemini(query, all_docs)
+                ranked_docs = self._rerank(query, all_docs)
             else:
                 ranked_docs = all_docs # Use the direct KG results
             # --- END OF DEFINITIVE FIX ---
 
             if not ranked_docs:
-                return "I found some information, but it did not seem relevant.", query_meta, tool_plan, final_results
+                return _Retrieval([], kg_success, query_meta, tool_plan, final_results, "I found some information, but it did not seem relevant.")
+            return _Retrieval(ranked_docs, kg_success, query_meta, tool_plan, final_results, None)
+
+    def _run_single_rag_step(self, query: str, persona: str, query_meta: Optional[QueryMetadata] = None, question: Optional[str] = None) -> Tuple[Iterator[str], QueryMetadata, List[ToolPlanItem], List[ToolResult]]:
+        """Retrieves for `query` and answers `question` (the user's question; defaults to `query`) over that evidence."""
+        question = question or query
+        with Timer(f"Single RAG Step for '{query[:30]}...'"):
+            retrieval = self._retrieve(query, persona, query_meta)
+            query_meta, tool_plan, final_results = retrieval.query_meta, retrieval.tool_plan, retrieval.tool_results
+            if retrieval.failure:
+                return iter([retrieval.failure]), query_meta, tool_plan, final_results
+
+            evidence_texts, citation_links = _split_evidence(retrieval.docs)
 
-            evidence_texts, citation_links = [], []
-            for doc in ranked_docs:
-                parts = doc.split("\nCitation: ")
-                evidence_texts.append(parts[0])
-                if len(parts) > 1:
-                    citation_links.append(parts[1])
+            # A lone graph triple for a fact lookup already is the answer; phrasing it through the LLM adds nothing.
+            # Graph rows arrive as separate documents, so this counts rows; several rows, or a multi-hop path, go through synthesis.
+            if (question == query and retrieval.kg_success and len(retrieval.docs) == 1 and len(evidence_texts) == 1
+                    and evidence_texts[0].startswith(_SINGLE_HOP_LABEL) and query_meta.intent == "specific_fact_lookup"):
+                logger.info("Single knowledge-graph fact found. Answering without LLM synthesis.")
+                answer_text = f"{_EVIDENCE_LABEL_RE.sub('', evidence_texts[0], count=1)} [1]"
+                return iter([answer_text + _format_references(answer_text, citation_links)]), query_meta, tool_plan, final_results
 
-            formatted_context = "\n\n".join([f"EVIDENCE [{i+1}]:\n{text}" for i, text in enumerate(evidence_texts)])
+            formatted_context = _number_evidence(evidence_texts)
             
             if query_meta.intent == "simple_summary":
-                final_prompt = SUMMARIZATION_PROMPT.format(context_str=formatted_context)
+                if len(formatted_context) > SUMMARY_MAP_THRESHOLD_CHARS:
+                    # Built lazily so a cached summary never pays for the map calls.
+                    final_prompt = lambda: render_summarization(context_str=self._map_summaries(formatted_context))
+                else:
+                    final_prompt = render_summarization(context_str=formatted_context)
             else:
-                final_prompt = DIRECT_SYNTHESIS_PROMPT.format(question=query, context_str=formatted_context)
-            
-            with Timer("Synthesis LLM Call (Flash)"):
-                response = self.synthesis_llm.generate_content(final_prompt, request_options=DEFAULT_REQUEST_OPTIONS)
-            answer_text = response.text.strip()
-            
-            final_response = answer_text
-            if query_meta.intent != "simple_summary":
-                used_indices = {int(m) - 1 for m in re.findall(r'\[(\d+)\]', answer_text)}
-                if used_indices:
-                    references_section = "\n\n**References**\n"
-                    unique_used_links = set()
-                    used_links_ordered = []
-                    for idx in sorted(list(used_indices)):
-                        if idx < len(citation_links):
-                            link = citation_links[idx]
-                            if link not in unique_used_links:
-                                unique_used_links.add(link)
-                                used_links_ordered.append(link)
-                    references_section += "\n".join([f"{i+1}. {link}" for i, link in enumerate(used_links_ordered)])
-                    final_response += references_section
-
-            return final_response, query_meta, tool_plan, final_results
-
-    def run(self, query: str, persona: str, chat_history: List[str]) -> str:
+                final_prompt = render_direct_synthesis(question=question, context_str=formatted_context)
+            context_key = make_cache_key("summary" if query_meta.intent == "simple_summary" else "direct", formatted_context)
+
+            answer_stream = self._stream_with_references(self._llm_for_intent(query_meta.intent), final_prompt, citation_links, add_references=query_meta.intent != "simple_summary", query=question, context_key=context_key)
+            return answer_stream, query_meta, tool_plan, final_results
+
+    def _map_summaries(self, formatted_context: str) -> str:
+        """Condenses each evidence block to a short summary in parallel; a block whose call fails is kept verbatim."""
+        blocks = _split_into_blocks(formatted_context.split("\n"), SUMMARY_MAP_BLOCK_CHARS)
+
+        def summarize_block(block: str) -> str:
+            try:
+                response = self.synthesis_llm.generate_content(render_map_summary(chunk=block), generation_config=MAP_SUMMARY_GENERATION_CONFIG, request_options=DEFAULT_REQUEST_OPTIONS)
+                return response.text.strip() or block
+            except Exception as e:
+                logger.warning(f"Block summary failed: {e}. Using the block as-is.")
+                return block
+
+        with Timer(f"Map step over {len(blocks)} evidence blocks"), ThreadPoolExecutor(max_workers=min(len(blocks), 8)) as executor:
+            summaries = list(executor.map(summarize_block, blocks))
+        return "\n\n".join(summaries)
+
+    def _synthesize_answer(self, llm, prompt: str) -> Iterator[str]:
+        """Streams the LLM answer chunk by chunk instead of blocking on the full response."""
+        response = llm.generate_content(prompt, stream=True, request_options=DEFAULT_REQUEST_OPTIONS)
+        for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+
+    def _llm_for_intent(self, intent: Optional[str]):
+        """Picks the synthesis model from MODEL_ROUTING; unknown intents use Flash."""
+        model_name = MODEL_ROUTING.get(intent, FLASH_MODEL)
+        return (self.llm if model_name == PRO_MODEL else self.synthesis_llm) or self.synthesis_llm
+
+    def _stream_with_references(self, llm, prompt: Union[str, Callable[[], str]], citation_links: List[str], add_references: bool, query: str, context_key: str) -> Iterator[str]:
+        """Streams the direct synthesis answer (or its cached copy), then appends the references it actually cited."""
+        answer_text = _synthesis_cache.get(query, context_key)
+        if answer_text is not None:
+            yield answer_text
+        else:
+            answer_parts = []
+            if callable(prompt):
+                prompt = prompt()
+            with Timer(f"Synthesis LLM Call ({llm.model_name})"):
+                for text in self._synthesize_answer(llm, prompt):
+                    answer_parts.append(text)
+                    yield text
+            answer_text = "".join(answer_parts)
+            # Only answers that streamed to completion reach this point and get cached.
+            if answer_text.strip():
+                _synthesis_cache.put(query, context_key, answer_text)
+        references = _format_references(answer_text, citation_links) if add_references else ""
+        if references:
+            yield references
+
+    def _answer_sub_questions(self, sub_questions: List[str], retrievals: List[_Retrieval]) -> List[dict]:
+        """Answers every sub-question in one Flash call over their pooled evidence; returns the scratchpad observations."""
+        answers = [retrieval.failure or "" for retrieval in retrievals]
+        citations: List[List[str]] = [[] for _ in retrievals]
+        answerable = [i for i, retrieval in enumerate(retrievals) if retrieval.docs]
+        if answerable:
+            # Sub-questions about the same corpus often retrieve the same snippets; each is sent once.
+            pooled_docs = list(dict.fromkeys(doc for retrieval in retrievals for doc in retrieval.docs))
+            evidence_texts, citation_links = _split_evidence(pooled_docs)
+            numbered_questions = "\n".join(f"{n}. {sub_questions[i]}" for n, i in enumerate(answerable, start=1))
+            prompt = render_batch_answer(questions=numbered_questions, context_str=_number_evidence(evidence_texts))
+            try:
+                with Timer(f"Batched sub-question synthesis ({len(answerable)} questions)"):
+                    response = self.synthesis_llm.generate_content(prompt, generation_config=BATCH_ANSWER_GENERATION_CONFIG, request_options=DEFAULT_REQUEST_OPTIONS)
+                    batch_answers = json.loads(response.text)
+            except Exception as e:
+                logger.error(f"Batched sub-question synthesis failed: {e}", exc_info=False)
+                batch_answers = []
+            for n, i in enumerate(answerable):
+                answer = batch_answers[n] if n < len(batch_answers) and isinstance(batch_answers[n], str) else ""
+                answers[i] = answer or "I could not produce an answer for this sub-question."
+                citations[i] = _cited_links(answer, citation_links)
+        return [{"sub_q": sub_q, "answer": answer.strip(), "citations": cited} for sub_q, answer, cited in zip(sub_questions, answers, citations)]
+
+    def run(self, query: str, persona: str, chat_history: List[str]) -> Iterator[str]:
+        """Answers the query, yielding the final answer in chunks as it is synthesized."""
         run_start_time = time.perf_counter()
-        final_answer, final_query_meta, final_tool_plan, final_tool_results = "", None, [], []
+        answer_parts, final_query_meta, final_tool_plan, final_tool_results = [], None, [], []
         try:
             with Timer("Full Agent Run"):
                 rewritten_query = self.rewriter.rewrite(query, chat_history)
-                chosen_persona = self.persona_classifier.classify(rewritten_query) if persona == "automatic" else persona
+
+                # Persona selection and query planning only depend on the rewritten query, so they
+                # run concurrently. Planning classifies and decomposes in a single Gemini call; its
+                # classification is reused when the plan is a single step.
+                with Timer("Concurrent Planning"), ThreadPoolExecutor(max_workers=2) as executor:
+                    persona_future = executor.submit(self.persona_classifier.classify, rewritten_query) if persona == "automatic" else None
+                    query_plan_future = executor.submit(self.classifier.classify_and_plan, rewritten_query)
+                    chosen_persona = persona_future.result() if persona_future else persona
+                    query_plan = query_plan_future.result()
                 persona_display_name = " ".join(word.capitalize() for word in chosen_persona.split("_"))
-                
-                with Timer("Decomposition"):
-                    decomp_prompt = DECOMPOSITION_PROMPT.format(chat_history="\n- ".join(chat_history), question=rewritten_query)
-                    decomp_response = self.synthesis_llm.generate_content(decomp_prompt, request_options=DEFAULT_REQUEST_OPTIONS)
-                    plan_data = extract_json_from_response(decomp_response.text)
 
-                requires_decomposition = plan_data.get("requires_decomposition", False)
-                plan = plan_data.get("plan", [rewritten_query])
+                if query_plan:
+                    requires_decomposition = query_plan.requires_decomposition
+                    plan = query_plan.plan or [rewritten_query]
+                    rewritten_query_meta = query_plan.to_metadata()
+                    join_instruction = query_plan.join.strip()
+                else:
+                    # Planning failed: answer the query directly and let the RAG step classify it.
+                    requires_decomposition, plan, rewritten_query_meta, join_instruction = False, [rewritten_query], None, ""
 
                 if not requires_decomposition or len(plan) <= 1:
                     logger.info(f"Executing single-step plan for query: '{plan[0]}'")
-                    synthesis_result, final_query_meta, final_tool_plan, final_tool_results = self._run_single_rag_step(plan[0], chosen_persona)
+                    precomputed_meta = rewritten_query_meta if plan[0] == rewritten_query else None
+                    synthesis_stream, final_query_meta, final_tool_plan, final_tool_results = self._run_single_rag_step(plan[0], chosen_persona, precomputed_meta)
                 else:
                     logger.info(f"Executing multi-step plan for query: '{rewritten_query}'")
-                    scratchpad = []
-                    
                     # --- START OF DEFINITIVE FIX: Smart Tool Execution ---
                     
                     # Identify which steps are for data retrieval vs. pure logic
@@ -202,35 +470,56 @@ class Agent:
                             logic_instruction = sub_q # This is the final instruction for the synthesizer
                         else:
                             retrieval_steps.append(sub_q)
+                    # The planner states the combining step explicitly; the keyword scan only covers plans that put it in `plan`.
+                    logic_instruction = join_instruction or logic_instruction
                     
-                    # Execute only the data retrieval steps in parallel
-                    with ThreadPoolExecutor(max_workers=len(retrieval_steps)) as executor:
-                        sub_futures = [executor.submit(self._run_single_rag_step, sub_q, chosen_persona) for sub_q in retrieval_steps]
-                        sub_results_list = [future.result() for future in sub_futures]
-                    
-                    # Build the scratchpad from the retrieval results
-                    for i, sub_q in enumerate(retrieval_steps):
-                        sub_answer, _, _, sub_tool_results = sub_results_list[i]
-                        observation = f"Observation for the question '{sub_q}':\n{sub_answer}"
-                        scratchpad.append(observation)
-                        if sub_tool_results: final_tool_results.extend(sub_tool_results)
+                    # Classify all sub-questions in one batched call, then run retrieval for the data steps in parallel
+                    # The sub-questions' embeddings are fetched in one call while they are being classified.
+                    prefetch_query_embeddings(retrieval_steps)
+                    sub_query_metas = self.classifier.classify_batch(retrieval_steps)
+                    if not retrieval_steps:
+                        # A plan with no retrieval step at all retrieves for the rewritten query itself.
+                        retrieval_steps, sub_query_metas = [rewritten_query], [rewritten_query_meta]
+                    if len(retrieval_steps) == 1 and not logic_instruction:
+                        # One observation and no join step leave nothing to combine: the direct synthesis
+                        # prompt (streamed, cached, with references) answers the user's question over that
+                        # step's evidence, and the reasoning call is skipped. With a join or logic step the
+                        # single observation still goes through reasoning synthesis below.
+                        logger.info("Plan has one retrieval step and nothing to combine. Using direct synthesis.")
+                        synthesis_stream, final_query_meta, final_tool_plan, final_tool_results = self._run_single_rag_step(retrieval_steps[0], chosen_persona, sub_query_metas[0], question=rewritten_query)
+                    else:
+                        with ThreadPoolExecutor(max_workers=len(retrieval_steps)) as executor:
+                            sub_futures = [executor.submit(self._retrieve, sub_q, chosen_persona, sub_meta) for sub_q, sub_meta in zip(retrieval_steps, sub_query_metas)]
+                            retrievals = [future.result() for future in sub_futures]
+                        for retrieval in retrievals:
+                            final_tool_results.extend(retrieval.tool_results)
+
+                        # All sub-questions are answered together, sharing one prefill of the pooled evidence
+                        observations = self._answer_sub_questions(retrieval_steps, retrievals)
+
+                        # Add the final logical instruction to the scratchpad if it exists
+                        if logic_instruction:
+                            observations.append({"final_instruction": logic_instruction})
 
-                    # Add the final logical instruction to the scratchpad if it exists
-                    if logic_instruction:
-                        scratchpad.append(f"Final Instruction: {logic_instruction}")
+                        synthesis_prompt = render_reasoning_synthesis(question=rewritten_query, scratchpad=json.dumps(observations, separators=(",", ":"), ensure_ascii=False))
+                        # A decomposed question combines several answers; it is routed as a comparison unless planning said otherwise.
+                        synthesis_stream = self._synthesize_answer(self._llm_for_intent(rewritten_query_meta.intent if rewritten_query_meta else "comparative_analysis"), synthesis_prompt)
 
                     # --- END OF DEFINITIVE FIX ---
 
-                    with Timer("Reasoning Synthesis LLM Call (Pro)"):
-                        synthesis_prompt = REASONING_SYNTHESIS_PROMPT.format(question=rewritten_query, scratchpad="\n\n---\n\n".join(scratchpad))
-                        synthesis_response = self.llm.generate_content(synthesis_prompt, request_options=DEFAULT_REQUEST_OPTIONS)
-                    synthesis_result = synthesis_response.text
-                
-                final_answer = f"Acting as a **{persona_display_name}**, here is what I found:\n\n{synthesis_result}" if persona == "automatic" else synthesis_result
-                return final_answer
+                if persona == "automatic":
+                    header = f"Acting as a **{persona_display_name}**, here is what I found:\n\n"
+                    answer_parts.append(header)
+                    yield header
+                with Timer("Streaming Synthesis"):
+                    for text in synthesis_stream:
+                        answer_parts.append(text)
+                        yield text
         except Exception as e:
             logger.error(f"An unexpected error occurred during agent run: {e}", exc_info=True)
-            return "I encountered a critical error. Please check the system logs."
+            error_message = "I encountered a critical error. Please check the system logs."
+            answer_parts.append(error_message)
+            yield error_message
         finally:
             run_end_time = time.perf_counter()
-            log_trace(query, persona, final_query_meta, final_tool_plan, final_tool_results, final_answer, run_end_time - run_start_time)
\ No newline at end of file
+            log_trace(query, persona, final_query_meta, final_tool_plan, final_tool_results, "".join(answer_parts), run_end_time - run_start_time)
\ No newline at end of file
@@ -0,0 +1,71 @@
+# FILE: src/common/disk_cache.py
+# V1.0: SQLite-backed key/value cache with per-entry TTL, so LLM results survive restarts.
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from src.tools.clients import get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SEC = 7 * 24 * 3600
+
+
+def make_cache_key(*parts: str) -> str:
+    """Builds a fixed-length key from its parts (e.g. classifier name, prompt fingerprint, query)."""
+    return hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def prompt_fingerprint(prompt: str) -> str:
+    """Short hash of a prompt template; including it in keys invalidates entries when the prompt changes."""
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=6).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, path: Path, default_ttl_sec: float = DEFAULT_TTL_SEC):
+        self.default_ttl_sec = default_ttl_sec
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Disk cache read failed: {e}")
+            return None
+        if not row or row[1] < time.time():
+            return None
+        return row[0]
+
+    def set(self, key: str, value: str, ttl_sec: Optional[float] = None) -> None:
+        expires_at = time.time() + (ttl_sec or self.default_ttl_sec)
+        try:
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Disk cache write failed: {e}")
+
+
+@lru_cache(maxsize=1)
+def get_disk_cache() -> Optional[DiskCache]:
+    """Opens the shared on-disk cache once. Returns None if the cache directory is unusable."""
+    path = Path(get_settings().CACHE_DIR) / "llm_cache.sqlite3"
+    try:
+        cache = DiskCache(path)
+        logger.info(f"Disk cache opened at '{path}'.")
+        return cache
+    except Exception as e:
+        logger.error(f"Failed to open disk cache at '{path}': {e}")
+        return None
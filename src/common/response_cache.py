@@ -0,0 +1,44 @@
+# FILE: src/common/response_cache.py
+# V1.0: Answer cache keyed on (question, evidence). Exact repeats are served from the on-disk
+# cache; paraphrased questions over the same evidence are matched by embedding similarity.
+
+import logging
+from typing import Optional
+
+from src.common.disk_cache import get_disk_cache, make_cache_key
+from src.common.semantic_cache import SemanticCache
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Caches LLM answers per namespace. A semantic hit only counts when the cached entry was
+    produced from the same evidence (`context_key`), so new retrieval results always miss.
+    """
+
+    def __init__(self, namespace: str, threshold: float = 0.95, maxsize: int = 1024):
+        self.namespace = namespace
+        self._semantic = SemanticCache(threshold=threshold, maxsize=maxsize)
+
+    def _exact_key(self, question: str, context_key: str) -> str:
+        return make_cache_key(self.namespace, " ".join(question.lower().split()), context_key)
+
+    def get(self, question: str, context_key: str) -> Optional[str]:
+        disk_cache = get_disk_cache()
+        if disk_cache:
+            cached = disk_cache.get(self._exact_key(question, context_key))
+            if cached is not None:
+                logger.info(f"{self.namespace} cache hit (exact).")
+                return cached
+        entry = self._semantic.get(self._semantic.embed(question))
+        if entry and entry[0] == context_key:
+            logger.info(f"{self.namespace} cache hit (semantic).")
+            return entry[1]
+        return None
+
+    def put(self, question: str, context_key: str, value: str) -> None:
+        disk_cache = get_disk_cache()
+        if disk_cache:
+            disk_cache.set(self._exact_key(question, context_key), value)
+        self._semantic.put(self._semantic.embed(question), (context_key, value))
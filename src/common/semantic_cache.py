@@ -0,0 +1,63 @@
+# FILE: src/common/semantic_cache.py
+# V1.0: Embedding-similarity cache for near-duplicate queries, backed by a NumPy ring buffer.
+
+import logging
+import threading
+from typing import Any, Optional
+
+import numpy as np
+
+from src.tools.clients import get_sentence_encoder
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Maps queries to cached values by cosine similarity of their sentence embeddings.
+    Holds at most `maxsize` entries and evicts the oldest first (FIFO).
+    If the local encoder is unavailable, every lookup is a miss and nothing is stored.
+    """
+
+    def __init__(self, threshold: float = 0.92, maxsize: int = 4096):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._vectors: Optional[np.ndarray] = None
+        self._values: list = [None] * maxsize
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def embed(self, query: str) -> Optional[np.ndarray]:
+        """Returns the L2-normalized embedding of the normalized query, or None if no encoder is available."""
+        encoder = get_sentence_encoder()
+        if encoder is None:
+            return None
+        normalized = " ".join(query.lower().split())
+        return encoder.encode(normalized, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+    def get(self, vector: Optional[np.ndarray]) -> Optional[Any]:
+        """Returns the value stored for the most similar query if it clears the threshold."""
+        if vector is None:
+            return None
+        with self._lock:
+            if not self._size:
+                return None
+            scores = self._vectors[:self._size] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                logger.info(f"Semantic cache hit (similarity={scores[best]:.3f}).")
+                return self._values[best]
+        return None
+
+    def put(self, vector: Optional[np.ndarray], value: Any) -> None:
+        """Stores the value under the embedding, overwriting the oldest entry when full."""
+        if vector is None:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            self._vectors[self._next] = vector
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.maxsize
+            self._size = min(self._size + 1, self.maxsize)
@@ -0,0 +1,71 @@
+# FILE: src/common/trace_writer.py
+# V1.1: Background writer that keeps trace-log file I/O off the request path.
+# Records are Pydantic models serialized straight to JSON by pydantic-core.
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUE_SIZE = 10000
+MAX_BATCH_SIZE = 256
+FLUSH_INTERVAL_SEC = 0.1
+DROP_LOG_INTERVAL_SEC = 60.0
+
+
+class TraceWriter:
+    """Appends trace records as JSON lines to a file from a daemon thread, batching writes."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+        self._dropped = 0
+        self._last_drop_log = 0.0
+        self._thread = threading.Thread(target=self._drain_forever, name="trace-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, record: BaseModel) -> None:
+        """Queues a record without blocking; drops it (and counts the drop) if the queue is full."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+            now = time.monotonic()
+            if now - self._last_drop_log >= DROP_LOG_INTERVAL_SEC:
+                logger.warning(f"Trace log queue is full; {self._dropped} records dropped so far.")
+                self._last_drop_log = now
+
+    def flush(self) -> None:
+        """Writes out everything currently queued. Called at interpreter exit."""
+        self._write_batch(self._take_batch(block=False))
+
+    def _take_batch(self, block: bool) -> list:
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=FLUSH_INTERVAL_SEC))
+            while len(batch) < MAX_BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write_batch(self, batch: list) -> None:
+        if not batch:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(record.model_dump_json() + "\n" for record in batch))
+        except Exception as e:
+            logger.error(f"Failed to write to trace log: {e}", exc_info=True)
+
+    def _drain_forever(self) -> None:
+        while True:
+            self._write_batch(self._take_batch(block=True))
@@ -1,7 +1,14 @@
 # FILE: src/common/utils.py
+import re
 import yaml
 from pathlib import Path
 
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+
 def load_config(file_path: str) -> dict:
     with open(Path(file_path), 'r') as f:
-        return yaml.safe_load(f)
\ No newline at end of file
+        return yaml.safe_load(f)
+
+def normalize_query(query: str) -> str:
+    """Lowercases, drops punctuation and collapses whitespace, so trivially different phrasings share a cache key."""
+    return " ".join(_NON_WORD_RE.sub(" ", query.lower()).split())
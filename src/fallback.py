@@ -22,8 +22,8 @@ def should_trigger_fallback(results: List[ToolResult]) -> bool:
         logger.info("Fallback triggered: no tool results returned.")
         return True
 
-    empty_or_failed = [r for r in results if not r.success or not r.content or len(r.content.strip()) < 5]
-    if len(empty_or_failed) == len(results):
+    # all() short-circuits on the first usable result, so the common case stops early.
+    if all(not r.success or not r.content or len(r.content.strip()) < 5 for r in results):
         logger.info("Fallback triggered: all tools failed or content was empty.")
         return True
 
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Union
 
 
 QueryIntent = Literal[
@@ -10,12 +10,40 @@ QueryIntent = Literal[
     "unknown"
 ]
 
+# Values of the `semantic_purpose` metadata field in the Pinecone index.
+QueryTheme = Literal[
+    "Oncology",
+    "Regulatory History",
+    "Efficacy Results",
+    "Safety Results",
+    "Clinical Trial Design",
+    "Pharmacoeconomic Analysis",
+    "Dosage and Administration",
+    "Drug/Therapy Description",
+    "Indication/Population Description"
+]
+
 
 class QueryMetadata(BaseModel):
     intent: QueryIntent
     keywords: List[str]
     question_is_graph_suitable: bool
-    themes: Optional[List[str]] = Field(default_factory=list, description="High-level themes for metadata filtering.")
+    themes: Optional[List[QueryTheme]] = Field(default_factory=list, description="High-level themes for metadata filtering.")
+
+
+class QueryPlan(QueryMetadata):
+    """Classification plus the decomposition decision, produced by one planning call."""
+    requires_decomposition: bool = False
+    plan: List[str] = Field(default_factory=list)
+    join: str = Field(default="", description="How the synthesizer should combine the sub-answers.")
+
+    def to_metadata(self) -> QueryMetadata:
+        return QueryMetadata(
+            intent=self.intent,
+            keywords=self.keywords,
+            question_is_graph_suitable=self.question_is_graph_suitable,
+            themes=self.themes,
+        )
 
 
 class ToolPlanItem(BaseModel):
@@ -49,4 +77,16 @@ class NamespaceConfig(BaseModel):
     top_k: int
 
 class RetrievalPlan(BaseModel):
-    namespaces: List[NamespaceConfig] = []
\ No newline at end of file
+    namespaces: List[NamespaceConfig] = []
+
+
+class TraceRecord(BaseModel):
+    timestamp: str
+    query: str
+    persona: str
+    intent: str
+    graph_suitable: Union[bool, str]
+    tool_plan: List[ToolPlanItem] = []
+    tool_results: List[ToolResult] = []
+    final_answer_preview: str
+    total_latency_sec: float
@@ -0,0 +1,34 @@
+# FILE: src/planner/_query_shape.py
+# V1.0: Dependency-free checks on a question's surface form, used by QueryClassifier to decide
+# when the planning prompt can be skipped and when a cached classification may be reused.
+
+import re
+from typing import List
+
+from src.common.utils import normalize_query
+
+# Anything that can join two subjects into one question: list punctuation, conjunctions and
+# comparison/quantifier words. Capitalization is deliberately not used; users type drug names
+# in lowercase as often as not.
+_MULTI_SUBJECT_RE = re.compile(
+    r"[,;/&+]|\b(?:and|or|nor|either|neither|both|each|all|every|compare[sd]?|comparing|comparison"
+    r"|vs\.?|versus|difference|differences|differ|between)\b",
+    re.IGNORECASE,
+)
+
+
+def is_obviously_single_step(query: str) -> bool:
+    """True only when nothing in the question could join two subjects. Errs towards planning."""
+    return _MULTI_SUBJECT_RE.search(query) is None
+
+
+
+def names_same_entities(keywords: List[str], query: str) -> bool:
+    """
+    Whether a classification extracted with `keywords` can be reused for `query`: every keyword
+    must appear in the query as whole words, and the query must not join further subjects.
+    """
+    if _MULTI_SUBJECT_RE.search(query):
+        return False
+    padded = f" {normalize_query(query)} "
+    return all(f" {normalize_query(keyword)} " in padded for keyword in keywords)
@@ -0,0 +1,70 @@
+# FILE: src/planner/_templates.py
+# V1.1 (Summary Requests): "Summarize X" / "overview of X" requests are classified locally as simple_summary.
+# V1.0: Fixed-form factoid questions whose classification is deterministic, so QueryClassifier
+# can answer them without a Gemini call. Each pattern captures the entity as the `entity` group.
+
+import re
+from typing import List, Optional, Pattern, Tuple
+
+from src.models import QueryMetadata
+
+# A single entity name: no commas or "and", so compound questions fall through to the LLM.
+_ENTITY = r"(?P<entity>(?:(?!\band\b)[\w\-\s/()'])+?)"
+_END = r"\s*\??\s*$"
+
+# (pattern, themes) pairs. Every template is a direct entity -> relationship lookup.
+FACTOID_TEMPLATES: List[Tuple[Pattern, List[str]]] = [
+    (re.compile(rf"^(?:who|which compan(?:y|ies)) (?:is|are) the sponsors? (?:for|of) {_ENTITY}{_END}", re.I), ["Regulatory History"]),
+    (re.compile(rf"^who (?:sponsors|sponsored|makes|manufactures) {_ENTITY}{_END}", re.I), ["Regulatory History"]),
+    (re.compile(rf"^what compan(?:y|ies) (?:sponsors?|sponsored|makes|manufactures) {_ENTITY}{_END}", re.I), ["Regulatory History"]),
+    (re.compile(rf"^what is the sponsor (?:for|of) {_ENTITY}{_END}", re.I), ["Regulatory History"]),
+    (re.compile(rf"^what (?:is|was) {_ENTITY} (?:used|indicated|approved) (?:to treat|for){_END}", re.I), ["Indication/Population Description"]),
+    (re.compile(rf"^what does {_ENTITY} treat{_END}", re.I), ["Indication/Population Description"]),
+    (re.compile(rf"^what (?:is|are) the indications? (?:for|of) {_ENTITY}{_END}", re.I), ["Indication/Population Description"]),
+    (re.compile(rf"^what (?:is|are) the (?:recommended )?(?:dosage|dose|doses) (?:for|of) {_ENTITY}{_END}", re.I), ["Dosage and Administration"]),
+    (re.compile(rf"^what (?:is|are) the trade ?names? (?:for|of) {_ENTITY}{_END}", re.I), ["Drug/Therapy Description"]),
+    (re.compile(rf"^what (?:is|are) the brand ?names? (?:for|of) {_ENTITY}{_END}", re.I), ["Drug/Therapy Description"]),
+    (re.compile(rf"^what (?:is|are) the generic names? (?:for|of) {_ENTITY}{_END}", re.I), ["Drug/Therapy Description"]),
+    (re.compile(rf"^what (?:type of )?submission (?:is|was) (?:made )?for {_ENTITY}{_END}", re.I), ["Regulatory History"]),
+    (re.compile(rf"^what (?:is|was) the listing type (?:for|of) {_ENTITY}{_END}", re.I), ["Regulatory History"]),
+]
+
+# Requests to summarize one subject (a meeting, a drug, a document). They never use the graph and
+# carry no themes, so vector search runs unfiltered. A trailing full stop is allowed here.
+_SUMMARY_END = r"\s*[?.]?\s*$"
+SUMMARY_TEMPLATES: List[Pattern] = [
+    re.compile(rf"^(?:please |can you |could you )?summari[sz]e (?:the )?{_ENTITY}{_SUMMARY_END}", re.I),
+    re.compile(rf"^(?:please |can you |could you )?(?:give|provide) (?:me )?(?:a |an )?(?:brief |short )?(?:summary|overview) of (?:the )?{_ENTITY}{_SUMMARY_END}", re.I),
+    re.compile(rf"^what (?:is|was) (?:the |a )?(?:summary|overview) of (?:the )?{_ENTITY}{_SUMMARY_END}", re.I),
+    re.compile(rf"^what happened (?:at|in|during) (?:the )?{_ENTITY}{_SUMMARY_END}", re.I),
+]
+
+
+def match_template(query: str) -> Optional[QueryMetadata]:
+    """Returns the fixed classification for a template question, or None for everything else."""
+    text = " ".join(query.split())
+    for pattern, themes in FACTOID_TEMPLATES:
+        match = pattern.match(text)
+        if match:
+            entity = match.group("entity").strip()
+            if not entity:
+                return None
+            return QueryMetadata(
+                intent="specific_fact_lookup",
+                keywords=[entity],
+                question_is_graph_suitable=True,
+                themes=list(themes),
+            )
+    for pattern in SUMMARY_TEMPLATES:
+        match = pattern.match(text)
+        if match:
+            entity = match.group("entity").strip()
+            if not entity:
+                return None
+            return QueryMetadata(
+                intent="simple_summary",
+                keywords=[entity],
+                question_is_graph_suitable=False,
+                themes=[],
+            )
+    return None
@@ -1,68 +1,155 @@
 # FILE: src/planner/persona_classifier.py
-# V1.1 (Resilience Fix): Added request_options to the generate_content call.
+# V1.7 (Margin Routing): Local routing needs a margin over the runner-up; without Gemini the keyword scorer is the fallback instead of the default persona.
+# V1.6 (Normalized Keys): The in-memory persona cache is keyed on the punctuation-insensitive normalized query.
+# V1.5 (System Instruction): The constant prompt prefix is bound to the model as its system instruction.
+# V1.4 (Compact Prompt): Short few-shot prompt with a constant prefix and a capped, greedy decode.
+# V1.3 (Local Routing): A keyword scorer answers confident cases locally; Gemini is only the fallback.
 
 import logging
-from typing import Literal
+import re
+import threading
+from functools import lru_cache
+from typing import Literal, Optional
+
+from cachetools import LRUCache
+
 # --- DEFINITIVE FIX: Import the config and model getter ---
-from src.tools.clients import get_flash_model, DEFAULT_REQUEST_OPTIONS
+from src.tools.clients import get_instructed_flash_model, PERSONA_REQUEST_OPTIONS, TRANSIENT_LLM_ERRORS
+from src.common.single_flight import SingleFlight
+from src.common.disk_cache import get_disk_cache, make_cache_key, prompt_fingerprint
+from src.common.utils import normalize_query
 
 logger = logging.getLogger(__name__)
 
 Persona = Literal["clinical_analyst", "health_economist", "regulatory_specialist"]
+VALID_PERSONAS = ("clinical_analyst", "health_economist", "regulatory_specialist")
+DEFAULT_PERSONA = "regulatory_specialist"
+PERSONA_CACHE_SIZE = 10_000
 
-PERSONA_CLASSIFICATION_PROMPT = """
-You are an expert request router. Your task is to analyze the user's question and determine which specialist persona is best equipped to answer it. You must choose from the available personas and provide ONLY the persona's key name as your response.
+# Word prefixes taken from the persona descriptions in the prompt below. A query is routed
+# locally when one persona holds at least KEYWORD_CONFIDENCE_THRESHOLD of all keyword hits and
+# leads the runner-up by KEYWORD_MIN_MARGIN hits. "outcome" is left out: every PBAC decision is an
+# outcome, so it says nothing about the persona.
+PERSONA_KEYWORDS = {
+    "clinical_analyst": ("treat", "condition", "indication", "dosage", "dose", "patient", "trial", "effective", "efficacy", "safety", "adverse", "mechanism"),
+    "health_economist": ("cost", "price", "pricing", "economic", "budget", "financial", "value", "policy", "reimburse"),
+    "regulatory_specialist": ("sponsor", "submission", "submit", "listing", "agenda", "meeting", "guideline", "change", "status", "pathway"),
+}
+KEYWORD_CONFIDENCE_THRESHOLD = 0.6
+KEYWORD_MIN_MARGIN = 2
+_WORD_RE = re.compile(r"[a-z]+")
 
-**Available Personas & Their Expertise:**
+# Constant instructions + few-shot examples, sent as the model's system instruction. Only the
+# suffix is built per request.
+PERSONA_CLASSIFICATION_PROMPT_PREFIX = """Route the question to one persona. Reply with the key only.
+clinical_analyst: efficacy, safety, dosage, indications, trials, patient outcomes.
+health_economist: cost, pricing, cost-effectiveness, budget impact, policy.
+regulatory_specialist: sponsors, submissions, listing types, meetings, guidelines, status.
 
-1.  **`clinical_analyst`**:
-    *   Focuses on: Clinical trial data, drug efficacy, safety profiles, patient outcomes, medical conditions, and mechanisms of action.
-    *   Keywords: treat, condition, indication, dosage, patients, trial, effective, side effects.
-    *   Choose this persona for questions about the medical and scientific aspects of a drug.
+Q: What are the side effects of Keytruda?
+A: clinical_analyst
+Q: Was the ICER for Trikafta acceptable?
+A: health_economist
+Q: Who sponsored the Opdivo submission?
+A: regulatory_specialist
+"""
+PERSONA_CLASSIFICATION_PROMPT_SUFFIX = "Q: {question}\nA:"
+PERSONA_CLASSIFICATION_PROMPT = PERSONA_CLASSIFICATION_PROMPT_PREFIX + PERSONA_CLASSIFICATION_PROMPT_SUFFIX
 
-2.  **`health_economist`**:
-    *   Focuses on: Cost-effectiveness, pricing, market access, economic evaluations, and healthcare policy implications.
-    *   Keywords: cost, price, economic, budget, financial, value, policy, summary.
-    *   Choose this persona for questions about the financial or policy-level impact of a drug.
+# The answer is a single key; "regulatory_specialist" needs a few tokens, so allow 8.
+PERSONA_GENERATION_CONFIG = {"max_output_tokens": 8, "temperature": 0.0, "stop_sequences": ["\n"]}
 
-3.  **`regulatory_specialist`**:
-    *   Focuses on: Submission types, meeting agendas, regulatory pathways (e.g., PBS listing types), sponsors, and official guidelines.
-    *   Keywords: sponsor, submission, listing, agenda, meeting, guideline, change, status.
-    *   Choose this persona for questions about the process and logistics of drug approval and listing.
+_PROMPT_FINGERPRINT = prompt_fingerprint(PERSONA_CLASSIFICATION_PROMPT)
 
-**User Question:**
-"{question}"
+@lru_cache(maxsize=2048)
+def _build_prompt(query: str) -> str:
+    return PERSONA_CLASSIFICATION_PROMPT_SUFFIX.format(question=query)
 
-**Instructions:**
-- Read the user's question carefully.
-- Compare it against the expertise of each persona.
-- Return ONLY the single key name (e.g., `clinical_analyst`) of the best-fitting persona. Do not add any explanation or other text.
-"""
 
 class PersonaClassifier:
     def __init__(self):
         # --- DEFINITIVE FIX: Use the new centralized model getter ---
-        self.llm = get_flash_model()
+        self.llm = get_instructed_flash_model(PERSONA_CLASSIFICATION_PROMPT_PREFIX)
         if not self.llm:
             logger.error("FATAL: Gemini client not initialized, PersonaClassifier will not work.")
+        # Exact-match cache of normalized query -> persona. Only valid keys are stored.
+        self._cache = LRUCache(maxsize=PERSONA_CACHE_SIZE)
+        self._cache_lock = threading.Lock()
+        self._inflight = SingleFlight()
 
     def classify(self, query: str) -> Persona:
         """Classifies the query and returns the most appropriate persona key."""
+        key = normalize_query(query)
         if not self.llm:
-            return "regulatory_specialist" # A safe default
+            # Without Gemini any strict keyword winner beats the blanket default.
+            return self._classify_by_keywords(key, min_margin=1) or DEFAULT_PERSONA
+
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        if cached:
+            logger.info(f"Persona cache hit: '{cached}' for query '{query}'")
+            return cached
 
+        persona_key = self._classify_by_keywords(key) or self._inflight.do(key, self._classify_uncached, query, key)
+        if not persona_key:
+            # Failures fall back to the default but are never memoized.
+            return DEFAULT_PERSONA
+        with self._cache_lock:
+            self._cache[key] = persona_key
+        return persona_key
+
+    def _classify_by_keywords(self, normalized_query: str, min_margin: int = KEYWORD_MIN_MARGIN) -> Optional[Persona]:
+        """Scores each persona by keyword hits; returns the winner only if it is a clear majority and leads by `min_margin`."""
+        words = _WORD_RE.findall(normalized_query)
+        scores = {
+            persona: sum(1 for word in words if word.startswith(keywords))
+            for persona, keywords in PERSONA_KEYWORDS.items()
+        }
+        total = sum(scores.values())
+        if not total:
+            return None
+        best, runner_up = sorted(scores, key=scores.get, reverse=True)[:2]
+        if scores[best] / total < KEYWORD_CONFIDENCE_THRESHOLD or scores[best] - scores[runner_up] < min_margin:
+            return None
+        logger.info(f"Query classified locally for persona: '{best}' (keyword scores: {scores})")
+        return best
+
+    def _classify_uncached(self, query: str, normalized_query: str) -> Optional[Persona]:
+        """Checks the on-disk cache, then runs the LLM classification; returns None on failure or an invalid key."""
+        disk_cache = get_disk_cache()
+        disk_key = make_cache_key("persona_classifier", _PROMPT_FINGERPRINT, normalized_query)
+        if disk_cache:
+            persisted = disk_cache.get(disk_key)
+            if persisted in VALID_PERSONAS:
+                logger.info(f"Persona disk cache hit: '{persisted}' for query '{query}'")
+                return persisted
         try:
-            prompt = PERSONA_CLASSIFICATION_PROMPT.format(question=query)
+            prompt = _build_prompt(query)
             # --- DEFINITIVE FIX: Add request_options to the call ---
-            response = self.llm.generate_content(prompt, request_options=DEFAULT_REQUEST_OPTIONS)
-            persona_key = response.text.strip()
+            response = self.llm.generate_content(
+                prompt,
+                generation_config=PERSONA_GENERATION_CONFIG,
+                request_options=PERSONA_REQUEST_OPTIONS,
+            )
+            persona_key = response.text.strip().strip("`")
 
-            if persona_key in ["clinical_analyst", "health_economist", "regulatory_specialist"]:
+            if persona_key in VALID_PERSONAS:
                 logger.info(f"Query classified for persona: '{persona_key}'")
+                if disk_cache:
+                    disk_cache.set(disk_key, persona_key)
                 return persona_key
             else:
                 logger.warning(f"Persona classification returned an invalid key: '{persona_key}'. Falling back to default.")
-                return "regulatory_specialist"
+                return None
+        except TRANSIENT_LLM_ERRORS as e:
+            logger.warning(f"Persona classification transient LLM failure: {e}")
+            return None
         except Exception as e:
             logger.error(f"Persona classification failed: {e}", exc_info=True)
-            return "regulatory_specialist" # Fallback on error
\ No newline at end of file
+            return None
+
+
+@lru_cache(maxsize=1)
+def get_persona_classifier() -> PersonaClassifier:
+    """Returns the process-wide PersonaClassifier so every session shares its persona cache."""
+    return PersonaClassifier()
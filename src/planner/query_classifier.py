@@ -1,54 +1,288 @@
 # FILE: src/planner/query_classifier.py
-# V1.4 (Final Fix): Corrected Pydantic model import and literal values.
+# V2.7 (Entity-Checked Semantic Hits): A near-duplicate classification is reused only if the new query names exactly its keywords.
+# V2.6 (Conservative Gate): The single-step bypass bails out on any list separator, conjunction or quantifier; capitalization is not used.
+# V2.5 (Exact LRU): Classifications and plans are memoized in process by normalized query, ahead of the embedding lookup.
+# V2.4 (Join Instruction): The plan carries the planner's instruction for combining sub-answers.
+# V2.3 (Schema Enums): Allowed themes are enforced by the response schema instead of being listed in the prompt.
+# V2.2 (Decomposition Gate): Obviously single-step questions skip the planning prompt and are only classified.
+# V2.1 (Fused Planning): classify_and_plan returns classification and decomposition from one call.
+# V2.0 (System Instruction): The classification rules live in the model's system instruction.
+# V1.9 (Streaming): Responses are streamed and parsing stops at the first complete JSON value.
+# V1.8 (Templates): Fixed-form factoid questions are classified by regex without a Gemini call.
+# V1.7 (Batching): Sub-questions are classified together in one Gemini call via classify_batch.
 
 import logging
-import json
-import re
-from typing import Optional
+import threading
+from functools import lru_cache
+from typing import List, Optional, Tuple, get_args
+
+import orjson
+from cachetools import LRUCache
+from pydantic import TypeAdapter
 
 # --- DEFINITIVE FIX: Import the correct model from src.models ---
-from src.models import QueryMetadata, QueryIntent
-from src.prompts import QUERY_CLASSIFICATION_PROMPT_V2 as QUERY_CLASSIFICATION_PROMPT
-from src.tools.clients import get_flash_model, DEFAULT_REQUEST_OPTIONS
+from src.models import QueryMetadata, QueryIntent, QueryPlan, QueryTheme
+from src.prompts import QUERY_CLASSIFICATION_PROMPT_V2 as QUERY_CLASSIFICATION_PROMPT, QUERY_PLANNING_PROMPT
+from src.tools.clients import get_instructed_flash_model, CLASSIFIER_REQUEST_OPTIONS, TRANSIENT_LLM_ERRORS
+from src.common.semantic_cache import SemanticCache
+from src.common.single_flight import SingleFlight
+from src.common.disk_cache import get_disk_cache, make_cache_key, prompt_fingerprint
+from src.planner._templates import match_template
+from src.planner._query_shape import is_obviously_single_step, names_same_entities
+from src.common.utils import normalize_query
 
 logger = logging.getLogger(__name__)
 
-def extract_json_from_response(text: str) -> dict:
-    """Finds and parses the first valid JSON object from a string."""
-    match = re.search(r'```json\s*(\{.*?\})\s*```', text, re.DOTALL)
-    if match:
+# Built once at import so each validation goes straight to the compiled pydantic-core validator.
+_QUERY_METADATA_ADAPTER = TypeAdapter(QueryMetadata)
+_QUERY_PLAN_ADAPTER = TypeAdapter(QueryPlan)
+
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX_SIZE = 4096
+# Verbatim repeats (demo questions, retries, repeated sub-questions) are answered from this before
+# the query is even embedded. Keys are ("classify" | "plan", normalized query).
+EXACT_CACHE_MAX_SIZE = 10_000
+# Larger batches make every query in the batch wait for the longest answer.
+MAX_CLASSIFICATION_BATCH_SIZE = 8
+
+# Gemini enforces this schema server-side, so the response is always a bare JSON object whose
+# `intent` and `themes` use the allowed literals; the prompts no longer need to spell them out.
+QUERY_METADATA_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": list(get_args(QueryIntent))},
+        "keywords": {"type": "array", "items": {"type": "string"}},
+        "themes": {"type": "array", "items": {"type": "string", "enum": list(get_args(QueryTheme))}},
+        "question_is_graph_suitable": {"type": "boolean"},
+    },
+    "required": ["intent", "keywords", "themes", "question_is_graph_suitable"],
+}
+CLASSIFICATION_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": QUERY_METADATA_RESPONSE_SCHEMA,
+}
+QUERY_PLAN_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **QUERY_METADATA_RESPONSE_SCHEMA["properties"],
+        "requires_decomposition": {"type": "boolean"},
+        "plan": {"type": "array", "items": {"type": "string"}},
+        "join": {"type": "string"},
+    },
+    "required": [*QUERY_METADATA_RESPONSE_SCHEMA["required"], "requires_decomposition", "plan", "join"],
+}
+PLANNING_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": QUERY_PLAN_RESPONSE_SCHEMA,
+}
+BATCH_CLASSIFICATION_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {"type": "array", "items": QUERY_METADATA_RESPONSE_SCHEMA},
+}
+
+
+_PROMPT_FINGERPRINT = prompt_fingerprint(QUERY_CLASSIFICATION_PROMPT)
+_PLANNING_PROMPT_FINGERPRINT = prompt_fingerprint(QUERY_PLANNING_PROMPT)
+
+@lru_cache(maxsize=2048)
+def _build_prompt(query: str) -> str:
+    return f"User Query: {query}"
+
+
+def _build_batch_prompt(queries: Tuple[str, ...]) -> str:
+    numbered_queries = "\n".join(f"{i+1}. {q}" for i, q in enumerate(queries))
+    return (
+        "Classify each of the following user queries independently. Return a JSON array with exactly one object per query, in the same order."
+        + f"\n\nUser Queries:\n{numbered_queries}"
+    )
+
+
+def _parse_streamed_json(chunks) -> object:
+    """Accumulates streamed text and returns as soon as the buffer parses as JSON."""
+    buffer = b""
+    for chunk in chunks:
+        if not chunk.parts:
+            continue
+        buffer += chunk.text.encode("utf-8")
         try:
-            return json.loads(match.group(1))
-        except json.JSONDecodeError:
-            pass
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        logger.warning(f"Could not parse JSON from response text: {text}")
-        return {}
+            return orjson.loads(buffer)
+        except orjson.JSONDecodeError:
+            continue
+    # Stream ended without a parseable prefix; raise the real decode error for the caller's log.
+    return orjson.loads(buffer)
 
 
 class QueryClassifier:
     def __init__(self):
-        self.model = get_flash_model()
+        self.model = get_instructed_flash_model(QUERY_CLASSIFICATION_PROMPT)
+        self.planning_model = get_instructed_flash_model(QUERY_PLANNING_PROMPT)
+        self._semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD, maxsize=SEMANTIC_CACHE_MAX_SIZE)
+        self._inflight = SingleFlight()
+        self._exact_cache = LRUCache(maxsize=EXACT_CACHE_MAX_SIZE)
+        self._exact_lock = threading.Lock()
+
+    def _exact_get(self, kind: str, query: str):
+        with self._exact_lock:
+            cached = self._exact_cache.get((kind, normalize_query(query)))
+        return cached.model_copy(deep=True) if cached else None
+
+    def _exact_put(self, kind: str, query: str, value) -> None:
+        if value is None:
+            return
+        with self._exact_lock:
+            self._exact_cache[(kind, normalize_query(query))] = value
+
+    def _semantic_get(self, query: str, query_vector) -> Optional[QueryMetadata]:
+        """
+        Near-duplicate lookup. MiniLM scores questions that differ only in the drug far above the
+        threshold, and the keywords drive Cypher and vector-cache scoping, so a hit whose keywords
+        the new query does not name exactly is treated as a miss.
+        """
+        cached = self._semantic_cache.get(query_vector)
+        if not cached:
+            return None
+        if not names_same_entities(cached.keywords, query):
+            logger.info(f"Semantic cache hit rejected: keywords {cached.keywords} do not match the query.")
+            return None
+        return cached.model_copy(deep=True)
 
     def classify(self, query: str) -> Optional[QueryMetadata]:
         if not self.model: return None
         logger.info(f"Classifying query: {query}")
+        templated = match_template(query)
+        if templated:
+            logger.info("Query matched a factoid template; skipping LLM classification.")
+            return templated
+        cached = self._exact_get("classify", query)
+        if cached:
+            return cached
+        query_vector = self._semantic_cache.embed(query)
+        cached = self._semantic_get(query, query_vector)
+        if cached:
+            return cached
+        # Concurrent callers with the same query share one in-flight Gemini call.
+        metadata = self._inflight.do(query, self._classify_uncached, query, query_vector)
+        self._exact_put("classify", query, metadata)
+        return metadata
+
+    def _classify_uncached(self, query: str, query_vector) -> Optional[QueryMetadata]:
+        disk_cache = get_disk_cache()
+        disk_key = make_cache_key("query_classifier", _PROMPT_FINGERPRINT, " ".join(query.lower().split()))
+        if disk_cache:
+            persisted = disk_cache.get(disk_key)
+            if persisted:
+                try:
+                    logger.info(f"Query classification disk cache hit for: {query}")
+                    return self._validate_and_cache(orjson.loads(persisted), query_vector)
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable disk cache entry: {e}")
         try:
-            prompt = QUERY_CLASSIFICATION_PROMPT + f"\n\nUser Query: {query}"
-            response = self.model.generate_content(prompt, request_options=DEFAULT_REQUEST_OPTIONS)
-            
-            json_data = extract_json_from_response(response.text)
-            
-            # --- DEFINITIVE FIX: Ensure intent matches the allowed literals ---
-            if "intent" in json_data and json_data["intent"] == "comparison":
-                json_data["intent"] = "comparative_analysis"
-            
-            metadata = QueryMetadata.model_validate(json_data)
-            
-            logger.info(f"Classification result: {metadata.model_dump_json(indent=2)}")
+            prompt = _build_prompt(query)
+            response = self.model.generate_content(prompt, generation_config=CLASSIFICATION_GENERATION_CONFIG, request_options=CLASSIFIER_REQUEST_OPTIONS, stream=True)
+            metadata = self._validate_and_cache(_parse_streamed_json(response), query_vector)
+            if disk_cache:
+                disk_cache.set(disk_key, metadata.model_dump_json())
             return metadata
+        except TRANSIENT_LLM_ERRORS as e:
+            logger.warning(f"Query classification transient LLM failure: {e}")
+            return None
         except Exception as e:
             logger.error(f"Query classification failed: {e}", exc_info=True)
-            return None
\ No newline at end of file
+            return None
+
+    def classify_and_plan(self, query: str) -> Optional[QueryPlan]:
+        """Classifies the query and decides on decomposition in a single Gemini call. Returns None on failure."""
+        if not self.planning_model: return None
+        templated = match_template(query)
+        if templated:
+            # Templates only match single-entity lookups, which never need decomposition.
+            return QueryPlan(**templated.model_dump(), requires_decomposition=False, plan=[query])
+        if is_obviously_single_step(query):
+            # The shorter classification call (and its semantic cache) is enough here.
+            metadata = self.classify(query)
+            return QueryPlan(**metadata.model_dump(), requires_decomposition=False, plan=[query]) if metadata else None
+        cached = self._exact_get("plan", query)
+        if cached:
+            return cached
+        query_plan = self._inflight.do(("plan", query), self._plan_uncached, query)
+        self._exact_put("plan", query, query_plan)
+        return query_plan
+
+    def _plan_uncached(self, query: str) -> Optional[QueryPlan]:
+        disk_cache = get_disk_cache()
+        disk_key = make_cache_key("query_planner", _PLANNING_PROMPT_FINGERPRINT, " ".join(query.lower().split()))
+        if disk_cache:
+            persisted = disk_cache.get(disk_key)
+            if persisted:
+                try:
+                    logger.info(f"Query plan disk cache hit for: {query}")
+                    return _QUERY_PLAN_ADAPTER.validate_json(persisted)
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable disk cache entry: {e}")
+        try:
+            response = self.planning_model.generate_content(f"User Question: {query}", generation_config=PLANNING_GENERATION_CONFIG, request_options=CLASSIFIER_REQUEST_OPTIONS, stream=True)
+            query_plan = _QUERY_PLAN_ADAPTER.validate_python(_parse_streamed_json(response))
+            # Sub-question and retry paths still go through classify(), so seed its cache too.
+            self._semantic_cache.put(self._semantic_cache.embed(query), query_plan.to_metadata())
+            if disk_cache:
+                disk_cache.set(disk_key, query_plan.model_dump_json())
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Query plan: %s", query_plan.model_dump_json())
+            return query_plan
+        except TRANSIENT_LLM_ERRORS as e:
+            logger.warning(f"Query planning transient LLM failure: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Query planning failed: {e}", exc_info=True)
+            return None
+
+    def classify_batch(self, queries: List[str]) -> List[Optional[QueryMetadata]]:
+        """Classifies several queries, sending all cache misses to Gemini in as few calls as possible."""
+        if not self.model: return [None] * len(queries)
+        if len(queries) == 1: return [self.classify(queries[0])]
+
+        results: List[Optional[QueryMetadata]] = [None] * len(queries)
+        query_vectors = [self._semantic_cache.embed(q) for q in queries]
+        misses = []
+        for i, query_vector in enumerate(query_vectors):
+            templated = match_template(queries[i])
+            if templated:
+                results[i] = templated
+                continue
+            cached = self._exact_get("classify", queries[i]) or self._semantic_get(queries[i], query_vector)
+            if cached:
+                results[i] = cached
+            else:
+                misses.append(i)
+
+        for start in range(0, len(misses), MAX_CLASSIFICATION_BATCH_SIZE):
+            batch = misses[start:start + MAX_CLASSIFICATION_BATCH_SIZE]
+            logger.info(f"Classifying {len(batch)} queries in a single batched call.")
+            try:
+                prompt = _build_batch_prompt(tuple(queries[i] for i in batch))
+                response = self.model.generate_content(prompt, generation_config=BATCH_CLASSIFICATION_GENERATION_CONFIG, request_options=CLASSIFIER_REQUEST_OPTIONS, stream=True)
+                items = _parse_streamed_json(response)
+                if len(items) != len(batch):
+                    raise ValueError(f"expected {len(batch)} classifications, got {len(items)}")
+                for i, item in zip(batch, items):
+                    results[i] = self._validate_and_cache(item, query_vectors[i])
+                    self._exact_put("classify", queries[i], results[i])
+            except Exception as e:
+                logger.warning(f"Batched classification failed: {e}. Falling back to per-query calls.")
+                for i in batch:
+                    results[i] = self.classify(queries[i])
+        return results
+
+    def _validate_and_cache(self, json_data: dict, query_vector) -> QueryMetadata:
+        metadata = _QUERY_METADATA_ADAPTER.validate_python(json_data)
+        # Only successfully validated results are cached.
+        self._semantic_cache.put(query_vector, metadata.model_copy(deep=True))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Classification result: %s", metadata.model_dump_json())
+        return metadata
+
+
+@lru_cache(maxsize=1)
+def get_query_classifier() -> QueryClassifier:
+    """Process-wide QueryClassifier; keeps one semantic cache for all sessions."""
+    return QueryClassifier()
@@ -1,19 +1,60 @@
 # FILE: src/planner/query_rewriter.py
-# V2.0 (Performance Fix): Added a heuristic check to bypass the LLM call for non-conversational queries.
+# V2.5 (Antecedent Scope): Local NER only looks at the previous user turn and never picks a company as the antecedent.
+# V2.4 (History Budget): The formatted chat history is capped at its prompt token budget.
+# V2.3 (System Instruction): Rules and examples are the model's system instruction; calls send only the task.
+# V2.2 (Local Resolver): Simple pronoun references are resolved with spaCy NER before falling back to Gemini.
 
 import logging
-from typing import List
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
 # --- DEFINITIVE FIX: Import the config and model getter ---
-from src.tools.clients import get_flash_model, DEFAULT_REQUEST_OPTIONS
+from src.tools.clients import get_instructed_flash_model, CLASSIFIER_REQUEST_OPTIONS, TRANSIENT_LLM_ERRORS
+from src.common.single_flight import SingleFlight
+from src.prompts import truncate_field
 
 logger = logging.getLogger(__name__)
 
 # --- DEFINITIVE FIX: Heuristic pre-flight check ---
 # A list of common words that indicate a query is conversational and likely needs context from chat history.
 # We check for these words (as whole words, case-insensitively) before making a slow API call.
-CONVERSATIONAL_TRIGGERS = {"it", "its", "they", "them", "that", "those", "this", "these"}
+_CONVERSATIONAL_TRIGGERS_RE = re.compile(r"\b(?:it|its|they|them|that|those|this|these)\b", re.IGNORECASE)
 
-REWRITE_PROMPT = """
+# Entity labels from the previous user turn that a pronoun in the new question may refer to.
+_ANTECEDENT_LABELS = {"ORG", "PRODUCT", "PERSON"}
+# Sponsors are the ORG entities the small model tags most reliably, but "it"/"its" almost always means
+# the drug being asked about. Company-like names are never used as the antecedent.
+_COMPANY_NAME_RE = re.compile(
+    r"\b(?:pty|ltd|limited|inc|corp|corporation|co|company|llc|plc|gmbh|ag|s\.?a|pharma|pharmaceuticals?|laboratories|labs|healthcare)\b\.?",
+    re.IGNORECASE,
+)
+_USER_TURN_PREFIX = "user: "
+# Only unambiguous singular references are rewritten locally; anything else goes to the LLM.
+_PRONOUN_SUBSTITUTIONS = [
+    (re.compile(r"\b(?:this|that) (?:drug|medicine|product)\b", re.IGNORECASE), "{entity}"),
+    (re.compile(r"\bits\b", re.IGNORECASE), "{entity}'s"),
+    (re.compile(r"\bit\b", re.IGNORECASE), "{entity}"),
+]
+
+@lru_cache(maxsize=1)
+def _get_nlp():
+    """Loads the spaCy pipeline once. spaCy is optional: returns None if it or the model is not installed."""
+    try:
+        import spacy
+        return spacy.load("en_core_web_sm")
+    except Exception as e:
+        logger.warning(f"spaCy pipeline unavailable, rewrites will use the LLM only: {e}")
+        return None
+
+@lru_cache(maxsize=256)
+def _format_history(history: Tuple[str, ...]) -> str:
+    """Joins history turns for the prompt. Memoized because the same recent window recurs within a session."""
+    return truncate_field("chat_history", "\n  - ".join(history))
+
+# Pronouns almost always refer to the last exchange or two, so older turns are not sent to the LLM.
+MAX_HISTORY_TURNS = 4
+
+REWRITE_SYSTEM_INSTRUCTION = """
 You are an expert query analyst. Your task is to rewrite a user's latest question into a standalone question that can be understood without the context of the chat history.
 
 **CRITICAL RULES:**
@@ -34,7 +75,9 @@ You are an expert query analyst. Your task is to rewrite a user's latest questio
   - assistant: Janssen-Cilag Pty Ltd. is the sponsor for Esketamine.
 - **Latest User Question:** What is the dosage form for Fruquintinib?
 - **Your Rewritten Question:** What is the dosage form for Fruquintinib?
+"""
 
+REWRITE_TASK_TEMPLATE = """
 **TASK:**
 - **Chat History:**
 {chat_history}
@@ -46,9 +89,10 @@ You are an expert query analyst. Your task is to rewrite a user's latest questio
 class QueryRewriter:
     def __init__(self):
         # --- DEFINITIVE FIX: Use the new centralized model getter ---
-        self.llm = get_flash_model()
+        self.llm = get_instructed_flash_model(REWRITE_SYSTEM_INSTRUCTION)
         if not self.llm:
             logger.error("FATAL: Gemini client not initialized, QueryRewriter will not work.")
+        self._inflight = SingleFlight()
 
     def rewrite(self, query: str, chat_history: List[str]) -> str:
         """Rewrites a conversational query into a standalone query, with a performance-enhancing pre-check."""
@@ -58,18 +102,54 @@ class QueryRewriter:
         # --- DEFINITIVE FIX: Performance optimization ---
         # Check if the query contains any conversational trigger words.
         # This avoids a slow network call for the majority of queries which are already standalone.
-        query_words = set(query.lower().split())
-        if not CONVERSATIONAL_TRIGGERS.intersection(query_words):
+        if _CONVERSATIONAL_TRIGGERS_RE.search(query) is None:
             logger.info(f"Query deemed standalone. Bypassing LLM rewrite. Query: '{query}'")
             return query
         # --- End of performance optimization ---
 
+        # Keep only the last two user/assistant exchanges to bound prompt size as the chat grows.
+        recent_history = chat_history[-MAX_HISTORY_TURNS:]
+
+        locally_rewritten = self._rewrite_with_ner(query, recent_history)
+        if locally_rewritten:
+            logger.info(f"Original query: '{query}' -> Locally rewritten query: '{locally_rewritten}'")
+            return locally_rewritten
+
+        # Identical (query, history) pairs in flight at the same time share one Gemini call.
+        return self._inflight.do((query, tuple(recent_history)), self._rewrite_with_llm, query, recent_history)
+
+    def _rewrite_with_ner(self, query: str, chat_history: List[str]) -> Optional[str]:
+        """Substitutes 'it'/'its'/'this drug' with the single non-company entity in the previous user turn, if there is exactly one."""
+        nlp = _get_nlp()
+        if not nlp:
+            return None
+        # The assistant's answer names sponsors, indications and other side entities; the subject the
+        # pronoun points back to is the one the user asked about.
+        user_turn = next((turn for turn in reversed(chat_history) if turn.startswith(_USER_TURN_PREFIX)), None)
+        if user_turn is None:
+            return None
+        candidates = []
+        for ent in nlp(user_turn[len(_USER_TURN_PREFIX):]).ents:
+            if ent.label_ in _ANTECEDENT_LABELS and not _COMPANY_NAME_RE.search(ent.text) and ent.text not in candidates:
+                candidates.append(ent.text)
+        if len(candidates) != 1:
+            return None
+
+        rewritten = query
+        for pattern, replacement in _PRONOUN_SUBSTITUTIONS:
+            rewritten = pattern.sub(replacement.format(entity=candidates[0]), rewritten)
+        # If any other reference ('they', 'those', ...) remains, the rule-based rewrite is not enough.
+        if _CONVERSATIONAL_TRIGGERS_RE.search(rewritten):
+            return None
+        return rewritten
+
+    def _rewrite_with_llm(self, query: str, chat_history: List[str]) -> str:
         try:
-            formatted_history = "\n  - ".join(chat_history)
-            prompt = REWRITE_PROMPT.format(chat_history=formatted_history, question=query)
+            formatted_history = _format_history(tuple(chat_history))
+            prompt = REWRITE_TASK_TEMPLATE.format(chat_history=formatted_history, question=query)
             
             # --- DEFINITIVE FIX: Add request_options to the call ---
-            response = self.llm.generate_content(prompt, request_options=DEFAULT_REQUEST_OPTIONS)
+            response = self.llm.generate_content(prompt, request_options=CLASSIFIER_REQUEST_OPTIONS)
             rewritten_query = response.text.strip()
             
             if rewritten_query:
@@ -78,6 +158,15 @@ class QueryRewriter:
             else:
                 logger.warning("Query rewrite resulted in an empty string. Using original query.")
                 return query
+        except TRANSIENT_LLM_ERRORS as e:
+            logger.warning(f"Query rewriting transient LLM failure: {e}")
+            return query
         except Exception as e:
             logger.error(f"Query rewriting failed: {e}", exc_info=True)
-            return query # Fallback to original query on error
\ No newline at end of file
+            return query # Fallback to original query on error
+
+
+@lru_cache(maxsize=1)
+def get_query_rewriter() -> QueryRewriter:
+    """Returns the shared QueryRewriter instance."""
+    return QueryRewriter()
@@ -1,9 +1,15 @@
 # FILE: src/planner/tool_planner.py
-# V2.0: Persona-Aware Tool Planner
+# V2.4: The map file's mtime is re-checked on every plan() call; an edited map is re-parsed and the plan table rebuilt without a restart.
+# V2.3: Persona-Aware Tool Planner. Intents resolve to integer ids that index frozen ranking tuples.
+# V2.2: The YAML map is parsed once per process and shared read-only.
+# V2.1: Scored, sorted tool lists are precomputed per (persona, intent).
 import logging
+import threading
 import yaml
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from types import MappingProxyType
+from typing import List, Dict, Mapping, Tuple
 
 from src.models import QueryMetadata, ToolPlanItem
 
@@ -42,67 +48,127 @@ INTENT_TOOL_SCORES = {
     },
 }
 DEFAULT_INTENT_SCORE = 0.5
+# Tools whose estimated coverage does not exceed this are never planned.
+MIN_TOOL_COVERAGE = 0.1
+
+# Intents are a small closed set, so each gets a row id. Intents without scores share the last row.
+_INTENT_IDS: Mapping[str, int] = MappingProxyType({intent: i for i, intent in enumerate(INTENT_TOOL_SCORES)})
+_UNSCORED_INTENT_ID = len(_INTENT_IDS)
+_INTENT_ROWS: Tuple[Mapping[str, float], ...] = (
+    *(MappingProxyType(INTENT_TOOL_SCORES[intent]) for intent in _INTENT_IDS),
+    MappingProxyType({}),
+)
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+PERSONA_TOOL_MAP_FILE = PROJECT_ROOT / "config" / "persona_tool_map.yml"
+
+# LibYAML's C loader when PyYAML was built with it; the pure-Python loader otherwise.
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@lru_cache(maxsize=1)
+def _load_persona_map_cached(path: str, mtime: float) -> Mapping:
+    """Parses the persona-tool map once per file version (`mtime`). Raises on a missing or malformed file."""
+    with open(path, 'r') as f:
+        persona_map = yaml.load(f, Loader=_YAML_LOADER) or {}
+    logger.info(f"Successfully loaded persona-tool map from '{path}'.")
+    return MappingProxyType(persona_map)
+
 
 class ToolPlanner:
     def __init__(self, coverage_threshold: float = 0.9):
         self.coverage_threshold = coverage_threshold
+        self._map_mtime = None
+        self._reload_lock = threading.Lock()
         self._load_persona_map()
+        self._build_plan_table()
+
+    def _map_file_mtime(self):
+        try:
+            return PERSONA_TOOL_MAP_FILE.stat().st_mtime
+        except OSError:
+            return None
 
     def _load_persona_map(self):
         """Loads the persona-to-tool mapping from the central YAML config."""
-        map_file = PROJECT_ROOT / "config" / "persona_tool_map.yml"
+        map_file = PERSONA_TOOL_MAP_FILE
+        self._map_mtime = self._map_file_mtime()
         try:
-            with open(map_file, 'r') as f:
-                self.persona_map = yaml.safe_load(f)
-            logger.info(f"Successfully loaded persona-tool map from '{map_file}'.")
+            self.persona_map = _load_persona_map_cached(str(map_file), self._map_mtime)
         except Exception as e:
             logger.error(f"FATAL: Could not load or parse persona-tool map from '{map_file}': {e}", exc_info=True)
             self.persona_map = {}
 
+    def _reload_if_changed(self):
+        """The planner lives as long as the cached Agent, so edits to the map file are detected here, not in __init__."""
+        if self._map_file_mtime() == self._map_mtime:
+            return
+        with self._reload_lock:
+            if self._map_file_mtime() == self._map_mtime:
+                return
+            mtime = self._map_file_mtime()
+            try:
+                persona_map = _load_persona_map_cached(str(PERSONA_TOOL_MAP_FILE), mtime)
+            except Exception as e:
+                # A half-saved or broken edit keeps the current plans instead of emptying them.
+                logger.error(f"Could not reload persona-tool map, keeping the previous one: {e}")
+                self._map_mtime = mtime
+                return
+            logger.info(f"Persona-tool map '{PERSONA_TOOL_MAP_FILE}' changed on disk. Reloaded.")
+            self.persona_map, self._map_mtime = persona_map, mtime
+            self._build_plan_table()
+
+    def _build_plan_table(self):
+        """
+        Scores, sorts and filters every persona's tools for every intent row once. `plan` then indexes
+        `self._plan_table[persona_key][intent_id]`; the last row is the ordering for intents
+        without an entry in INTENT_TOOL_SCORES, where every tool gets DEFAULT_INTENT_SCORE.
+        """
+        # Built aside and swapped in whole, so concurrent plan() calls never see a half-built table.
+        plan_table: Dict[str, Tuple[Tuple[Tuple[str, float], ...], ...]] = {}
+        for persona_key, persona_prefs in self.persona_map.items():
+            persona_tool_weights: Dict[str, float] = {p["tool_name"]: p["weight"] for p in persona_prefs or []}
+            rankings = []
+            for intent_scores in _INTENT_ROWS:
+                # The final score reflects both the persona's general preference and the tool's suitability for the task
+                scored_tools = [
+                    (tool_name, persona_weight * intent_scores.get(tool_name, DEFAULT_INTENT_SCORE))
+                    for tool_name, persona_weight in persona_tool_weights.items()
+                ]
+                scored_tools.sort(key=lambda x: x[1], reverse=True)
+                # We treat the rounded score as the estimated coverage; tools with negligible
+                # contribution are dropped here so `plan` never has to skip them.
+                rankings.append(tuple(
+                    (tool_name, round(score, 2)) for tool_name, score in scored_tools if round(score, 2) > MIN_TOOL_COVERAGE
+                ))
+            plan_table[persona_key] = tuple(rankings)
+        self._plan_table = plan_table
+
     def plan(self, query_meta: QueryMetadata, persona: str) -> List[ToolPlanItem]:
         """
         Creates a ranked tool plan by combining query intent with user persona preferences.
         """
         logger.info(f"Planning tools for intent '{query_meta.intent}' and persona '{persona}'")
+        self._reload_if_changed()
+        plan_table = self._plan_table
         
-        # 1. Get the list of preferred tools and their weights for the given persona
+        # 1. Look up the precomputed ranking for this persona (or the default) and intent
         persona_key = persona.lower().replace(" ", "_")
-        persona_prefs = self.persona_map.get(persona_key, self.persona_map.get("default", []))
+        if persona_key not in plan_table:
+            persona_key = "default"
+        intent_id = _INTENT_IDS.get(query_meta.intent, _UNSCORED_INTENT_ID)
+        persona_rankings = plan_table.get(persona_key)
+        scored_tools = persona_rankings[intent_id] if persona_rankings else ()
 
-        if not persona_prefs:
+        if not scored_tools:
             logger.warning(f"No tool preferences found for persona '{persona_key}' or default. Returning empty plan.")
             return []
-            
-        persona_tool_weights: Dict[str, float] = {p["tool_name"]: p["weight"] for p in persona_prefs}
-        
-        # 2. Get intent-based scores for tools relevant to the current query intent
-        intent_scores = INTENT_TOOL_SCORES.get(query_meta.intent, {})
 
-        # 3. Calculate a final score for each tool by multiplying persona weight and intent score
-        scored_tools = []
-        for tool_name, persona_weight in persona_tool_weights.items():
-            intent_score = intent_scores.get(tool_name, DEFAULT_INTENT_SCORE)
-            
-            # The final score reflects both the persona's general preference and the tool's suitability for the task
-            final_score = persona_weight * intent_score
-            scored_tools.append({"name": tool_name, "score": final_score})
-
-        # 4. Sort tools by their final score in descending order
-        scored_tools.sort(key=lambda x: x["score"], reverse=True)
-
-        # 5. Build the final plan, adding tools until the cumulative coverage threshold is met
+        # 2. Build the final plan, adding tools until the cumulative coverage threshold is met
         final_plan: List[ToolPlanItem] = []
         total_coverage = 0.0
-        for tool in scored_tools:
-            # We treat the score as the estimated coverage for this planning step
-            estimated_coverage = round(tool["score"], 2)
-
-            # Do not add tools with negligible contribution
-            if estimated_coverage <= 0.1:
-                continue
-
-            plan_item = ToolPlanItem(tool_name=tool["name"], estimated_coverage=estimated_coverage)
+        for tool_name, estimated_coverage in scored_tools:
+            # Values come from our own table (str name, rounded float), so validation is skipped.
+            plan_item = ToolPlanItem.model_construct(tool_name=tool_name, estimated_coverage=estimated_coverage)
             final_plan.append(plan_item)
             
             total_coverage += estimated_coverage
@@ -110,5 +176,7 @@ class ToolPlanner:
                 logger.info(f"Coverage threshold of {self.coverage_threshold} met. Finalizing plan.")
                 break
         
-        logger.info(f"Generated tool plan: {[t.model_dump_json(indent=2) for t in final_plan]}")
+        # Serializing the plan costs a model_dump per item, so skip it when INFO is not emitted.
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Generated tool plan: %s", [t.model_dump() for t in final_plan])
         return final_plan
\ No newline at end of file
@@ -3,12 +3,34 @@
 # This version includes a highly robust Cypher generation prompt with multiple
 # examples, enhanced decomposition and synthesis logic for complex reasoning,
 # and dedicated prompts for direct synthesis and summarization.
+# V3.3 (Cache-Friendly Layout): Every template keeps its static instructions and examples as
+# a prefix and its placeholders at the end, so repeated calls share an identical token prefix.
+# V3.4 (Retrieved Few-Shot): The Cypher example gallery is filled per question from config/cypher_examples.jsonl.
+# V3.5 (Normalized): Prompts are whitespace- and markup-normalized once at import.
+# V3.6 (Structured Cypher): Cypher output format is enforced by a response schema, not by instructions.
+# V3.7 (Schema Enums): The intent and theme value lists live in the classifier's response schema, not the prompt text.
+# V3.8 (Map-Reduce Summaries): A short fixed map prompt condenses each block of a long evidence set before SUMMARIZATION_PROMPT runs.
+# V3.9 (Field Budgets): Renderers cap the variable-length fields (evidence, scratchpad, history) at a token budget.
+# V3.10 (JSON Scratchpad): Reasoning synthesis reads its observations as a compact JSON array.
+# V3.11 (Cleanup): Removed DECOMPOSITION_PROMPT; QUERY_PLANNING_PROMPT has replaced it since the fused planning call.
+# V3.12 (Join Instruction): The planning prompt also emits the instruction for combining the sub-answers.
+# V3.13 (Parameterized Cypher): Generated Cypher references values as $parameters listed in `params`.
+# V3.14 (Compact Re-ranking): The re-ranking few-shot and output rules are condensed; the response schema enforces the format.
+# V3.15 (Batched Sub-Answers): New BATCH_ANSWER_PROMPT answers all sub-questions of a plan in one call.
+# V3.16 (Re-ranking System Instruction): RERANKING_PROMPT is split into a system instruction and a short task template.
 
 """
 Production-grade prompts for a robust RAG agent. This version supports both
 direct RAG and a multi-step ReAct (Reason+Act) style reasoning loop.
 """
 
+import logging
+import re
+from string import Formatter
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
 # ==============================================================================
 # PROMPT 1: QUERY CLASSIFICATION
 # ==============================================================================
@@ -17,13 +39,12 @@ You are an expert query analysis agent. Your task is to analyze the user's quest
 
 **Fields to Generate:**
 
-1.  `intent`: Classify the user's goal. Choose exactly one from: ["specific_fact_lookup", "simple_summary", "comparative_analysis", "general_qa", "unknown"].
+1.  `intent`: Classify the user's goal.
 2.  `keywords`: Extract key nouns and proper nouns like drug names, company names, etc.
-3.  `themes`: Extract high-level conceptual themes from the question. Choose from this list: ["Oncology", "Regulatory History", "Efficacy Results", "Safety Results", "Clinical Trial Design", "Pharmacoeconomic Analysis", "Dosage and Administration", "Drug/Therapy Description", "Indication/Population Description"]. Return an empty list if no theme applies.
+3.  `themes`: Extract high-level conceptual themes from the question. Return an empty list if no theme applies.
 4.  `question_is_graph_suitable`: Return `true` if the question asks for a direct relationship between two specific entities (e.g., "Who sponsors DrugX?", "What does DrugY treat?"). Return `false` for summaries, comparisons, or general questions.
 
 **CRITICAL INSTRUCTIONS:**
-- Output ONLY the raw JSON object. Do not add explanations or markdown code fences.
 - If the question is "What is Amivantamab used to treat?", the relationship is (Amivantamab -> used to treat -> ?), so `question_is_graph_suitable` MUST be `true`.
 - If the question is "Summarize the May meeting", there is no direct relationship, so `question_is_graph_suitable` MUST be `false`.
 """
@@ -34,104 +55,51 @@ You are an expert query analysis agent. Your task is to analyze the user's quest
 CYPHER_GENERATION_PROMPT = """
 You are an expert Neo4j Cypher query developer. Your task is to convert a user's question into a single, valid, read-only Cypher query based on the provided graph schema and examples.
 
-**Live Graph Schema:**
-{schema}
-
 **CRITICAL Instructions:**
 1.  **Analyze the question deeply.** Identify all entities and the relationships between them.
 2.  **Construct a valid Cypher query** to find the answer. The query must be read-only.
-3.  **Always query against the `name_normalized` property for nodes** (e.g., `WHERE drug.name_normalized = 'abaloparatide'`).
-4.  **To filter by properties on a relationship, you MUST name the relationship in the MATCH clause** (e.g., `MATCH (d)-[r:HASSPONSOR]->(s)`) and then use it in the WHERE clause (e.g., `WHERE r.doc_id CONTAINS 'March-2025'`).
+3.  **Always query against the `name_normalized` property for nodes** (e.g., `WHERE drug.name_normalized = $drug`).
+4.  **To filter by properties on a relationship, you MUST name the relationship in the MATCH clause** (e.g., `MATCH (d)-[r:HASSPONSOR]->(s)`) and then use it in the WHERE clause (e.g., `WHERE r.doc_id CONTAINS $meeting`).
 5.  **Return Path and Properties:** Your `RETURN` clause must always be `RETURN p, properties(r) as rel_props`. The `r` must be the primary relationship in the path `p`.
-6.  **Handle Failure:** If the question cannot be answered with a Cypher query from the schema, you MUST return the single word: `NONE`.
-7.  **Output ONLY the Cypher query or the word `NONE`.**
+6.  **Handle Failure:** If the question cannot be answered with a Cypher query from the schema, set `cypher` to the single word `NONE`.
+7.  **Batch lists of entities:** If the question references several entities of the same kind (e.g., "compare drugs A, B and C"), do NOT write one `MATCH` per entity. Write a single query that uses `UNWIND $entities AS name` and put the normalized names in `entities`.
+8.  **Never inline literal values.** Reference every value as a parameter (`$drug`, `$meeting`, ...) and list each one in `params` as a `name`/`value` pair, with entity names lowercased as stored in `name_normalized`.
 
 ---
-**Example Gallery:**
-
-**# Example 1: Simple Fact Retrieval**
-Question: "What company sponsors Abaloparatide?"
-Cypher: MATCH p=(drug:Entity)-[r:HASSPONSOR]->(sponsor:Entity) WHERE drug.name_normalized = 'abaloparatide' RETURN p, properties(r) as rel_props
+**Live Graph Schema:**
+{schema}
 
-**# Example 2: Multi-Hop / "Bridge" Query**
-Question: "What is the indication for the drug whose trade name is Cabometyx?"
-Cypher: MATCH p=(trade_name:Entity)<-[r:HASTRADENAME]-(drug:Entity)-[:HASINDICATION]->(indication:Entity) WHERE trade_name.name_normalized = 'cabometyx' RETURN p, properties(r) as rel_props
+---
+**Example Gallery (the most similar curated examples):**
 
-**# Example 3: Filtering by Relationship Property**
-Question: "List all sponsors who made submissions in the March 2025 PBAC meeting."
-Cypher: MATCH p=(drug:Entity)-[r:HASSPONSOR]->(sponsor:Entity) WHERE r.doc_id CONTAINS 'March-2025' RETURN p, properties(r) as rel_props
+{examples}
 ---
 
 **Current Task:**
 Question: {question}
 """
 
-# ==============================================================================
-# PROMPT 3: QUERY DECOMPOSITION
-# ==============================================================================
-DECOMPOSITION_PROMPT = """
-You are a master query planner. Your goal is to determine if a user's question can be answered in a single step or if it requires decomposition into multiple, simpler sub-questions for data retrieval.
-
-Analyze the user's question.
-
-**Decision Criteria:**
-- **Single Step:** If the question asks for a direct fact about a single subject.
-- **Decomposition:** If the question requires comparing or combining information from two or more distinct subjects (e.g., two drugs, two meetings).
-
-**Output Schema:**
-You MUST output a single, valid JSON object with two keys:
-1.  `requires_decomposition`: A boolean (`true` or `false`).
-2.  `plan`: A list of strings.
-    - If `requires_decomposition` is `false`, the plan should be a list with the original question as the single item.
-    - If `requires_decomposition` is `true`, the plan should be a list of simple, factual retrieval questions, one for each subject. **Do not include a final step to combine the results; the final synthesizer will do that.**
-
-**Example 1 (Single Step):**
-- User Question: "What is the use of Esketamine?"
-- Your JSON Output:
-{{
-  "requires_decomposition": false,
-  "plan": ["What is the use of Esketamine?"]
-}}
-
-**Example 2 (Decomposition for Comparison/Intersection):**
-- User Question: "Compare the submission purposes for Acalabrutinib and Alectinib."
-- Your JSON Output:
-{{
-  "requires_decomposition": true,
-  "plan": [
-    "What was the submission purpose for Acalabrutinib?",
-    "What was the submission purpose for Alectinib?"
-  ]
-}}
-
-**TASK:**
-- Chat History: {chat_history}
-- User Question: {question}
-
-Now, generate the JSON output.
-"""
-
 # ==============================================================================
 # PROMPT 4: REASONING SYNTHESIS (REFINED)
 # ==============================================================================
 REASONING_SYNTHESIS_PROMPT = """
 You are a highly intelligent synthesis agent. Your task is to provide a final, comprehensive answer to the user's original question by reasoning over the observations you have collected.
 
-**User's Original Question:** "{question}"
-
-**Your Observations (Scratchpad):**
----
-{scratchpad}
----
-
 **CRITICAL INSTRUCTIONS:**
 1.  **Analyze the User's Original Question** to understand the final logical operation required (e.g., comparison, intersection, summarization).
-2.  **Review all Observations.** These are the facts you have gathered.
+2.  **Review all Observations.** These are the facts you have gathered. The scratchpad is a JSON array with one `{{"sub_q", "answer", "citations"}}` object per sub-question, optionally followed by a `{{"final_instruction"}}` object describing the last step.
 3.  **Perform the Required Logic.** If the original question was a comparison, compare the facts. If it asked for items in common, find the intersection of the lists in your observations.
 4.  **Handle Partial or Missing Information Gracefully.** This is your most important task. If you have an answer for one part of the question but not another, you **MUST** state that clearly. For example: "The submission purpose for Alectinib was a change to the existing listing [cite]. However, I could not find any information regarding the submission purpose for Acalabrutinib." Do not give a generic failure message.
 5.  **Synthesize the Final Answer.** Do not show your step-by-step reasoning. Just provide the final, clean, and comprehensive answer.
 6.  Include citations from your observations where appropriate.
 
+**User's Original Question:** "{question}"
+
+**Your Observations (Scratchpad, JSON array):**
+---
+{scratchpad}
+---
+
 **Final Answer:**
 """
 
@@ -143,7 +111,7 @@ You are a precise, professional document analysis bot. Your ONLY job is to answe
 
 **TASK:**
 1.  Read the User's Question.
-2.  Read the numbered evidence blocks (`EVIDENCE [1]`, `EVIDENCE [2]`, etc.).
+2.  Read the numbered evidence lines (`[1]`, `[2]`, etc.).
 3.  Synthesize a direct, professional answer to the question.
 4.  When you use information from a piece of evidence, you **MUST** cite it by placing its corresponding number in brackets, like `[1]`.
 5.  Cite each piece of evidence you use. If multiple pieces of evidence support a single point, you can cite them together, like `[1][2]`.
@@ -153,11 +121,8 @@ You are a precise, professional document analysis bot. Your ONLY job is to answe
 **EXAMPLE:**
 User's Question: "What is the sponsor and dosage form for Abaloparatide?"
 Evidence:
-EVIDENCE [1]:
-Evidence from graph: ABALOPARATIDE has sponsor THERAMEX AUSTRALIA PTY LTD.
-
-EVIDENCE [2]:
-Evidence from document: The submission for Abaloparatide was for a 3mg dosage form.
+[1] ABALOPARATIDE has sponsor THERAMEX AUSTRALIA PTY LTD.
+[2] The submission for Abaloparatide was for a 3mg dosage form.
 
 Your Answer:
 The sponsor for Abaloparatide is Theramex Australia Pty Ltd [1]. The dosage form submitted was 3 mg [2].
@@ -195,43 +160,182 @@ You are a professional medical and regulatory writer. Your task is to synthesize
 # ==============================================================================
 # PROMPT 7: RE-RANKING
 # ==============================================================================
-RERANKING_PROMPT = """
-You are a highly intelligent and precise relevance-ranking model. Your task is to analyze a user's question and a list of retrieved documents, and then return a JSON list of the document indices that are most relevant for answering the question.
+RERANKING_SYSTEM_INSTRUCTION = """
+You are a precise relevance-ranking model. Given a question and numbered documents, return the indices of the documents that directly help answer it.
 
 **CRITICAL INSTRUCTIONS:**
-1.  Read the user's question to understand their core intent.
-2.  Read each document, identified by its index (e.g., `DOCUMENT[0]`, `DOCUMENT[1]`).
-3.  Determine which documents contain direct, explicit information that helps answer the question.
-4.  Your output **MUST** be a single, valid JSON array of integers, representing the indices of the most relevant documents, sorted from most relevant to least relevant.
-5.  Include **ONLY** the indices of documents that are directly relevant. If a document is only tangentially related, do not include its index.
-6.  If **NO** documents are relevant, return an empty JSON array `[]`.
-7.  Do not include more than the top 5 most relevant document indices.
+1.  Include **ONLY** documents with direct, explicit information for the question; leave out tangential ones.
+2.  Order the indices from most to least relevant and return at most 5. Return `[]` if none are relevant.
 
 **EXAMPLE:**
-- **User Question:** "What is the dosage form for Apomorphine?"
-- **Documents:**
-  DOCUMENT[0]:
-  Evidence from document: The sponsor for Apomorphine is STADA...
-  Citation: <a...>
-  
-  DOCUMENT[1]:
-  Evidence from document: Movapo® (apomorphine hydrochloride hemihydrate) is available as a solution for subcutaneous infusion...
-  Citation: <a...>
-  
-  DOCUMENT[2]:
-  Evidence from document: The PBAC recommended the listing of Abaloparatide...
-  Citation: <a...>
-
-- **Your JSON Output:**
-  [1]
-
----
-**TASK:**
+Question: "What is the dosage form for Apomorphine?"
+DOCUMENT[0]: The sponsor for Apomorphine is STADA...
+DOCUMENT[1]: Movapo® (apomorphine hydrochloride hemihydrate) is available as a solution for subcutaneous infusion...
+DOCUMENT[2]: The PBAC recommended the listing of Abaloparatide...
+Output: [1]
+"""
 
+# Sent per call; the instructions above are bound to the re-ranker model as its system instruction.
+RERANKING_TASK_TEMPLATE = """
 **User Question:** "{question}"
 
 **Documents:**
 {documents}
+"""
+
+# ==============================================================================
+# PROMPT 8: QUERY PLANNING (CLASSIFICATION + DECOMPOSITION IN ONE CALL)
+# ==============================================================================
+QUERY_PLANNING_PROMPT = """
+You are an expert query analysis and planning agent. Analyze the user's question and return a single JSON object with seven fields.
+
+**Classification Fields:**
+1.  `intent`: Classify the user's goal.
+2.  `keywords`: Extract key nouns and proper nouns like drug names, company names, etc.
+3.  `themes`: Extract high-level conceptual themes from the question. Return an empty list if no theme applies.
+4.  `question_is_graph_suitable`: Return `true` if the question asks for a direct relationship between two specific entities (e.g., "Who sponsors DrugX?", "What does DrugY treat?"). Return `false` for summaries, comparisons, or general questions.
+
+**Planning Fields:**
+5.  `requires_decomposition`: `true` only if the question compares or combines information about two or more distinct subjects (e.g., two drugs, two meetings); `false` for a direct question about a single subject.
+6.  `plan`: If `requires_decomposition` is `false`, a list with the original question as the single item. Otherwise, a list of simple, factual retrieval questions, one per subject. Do not include a final step to combine the results; the final synthesizer will do that.
+7.  `join`: If `requires_decomposition` is `true`, one short instruction telling the synthesizer how to combine the sub-answers (e.g., "Compare the submission purposes."). Otherwise an empty string.
+
+**Example 1 (Single Step):**
+- User Question: "What is Amivantamab used to treat?"
+- Output: {"intent": "specific_fact_lookup", "keywords": ["Amivantamab"], "themes": ["Indication/Population Description"], "question_is_graph_suitable": true, "requires_decomposition": false, "plan": ["What is Amivantamab used to treat?"], "join": ""}
+
+**Example 2 (Decomposition):**
+- User Question: "Compare the submission purposes for Acalabrutinib and Alectinib."
+- Output: {"intent": "comparative_analysis", "keywords": ["Acalabrutinib", "Alectinib"], "themes": ["Regulatory History"], "question_is_graph_suitable": false, "requires_decomposition": true, "plan": ["What was the submission purpose for Acalabrutinib?", "What was the submission purpose for Alectinib?"], "join": "Compare the two submission purposes."}
+"""
+
+# ==============================================================================
+# PROMPT 9: BLOCK SUMMARY (MAP STEP FOR LONG SUMMARIES)
+# ==============================================================================
+# Run once per evidence block; the partial summaries then go through SUMMARIZATION_PROMPT.
+# Everything before `{chunk}` is identical across blocks and calls.
+MAP_SUMMARY_PROMPT = """
+Summarize this evidence block in at most 2 sentences. Keep drug names, sponsors, dates and numbers exactly as written. Use only the evidence.
+
+**Evidence Block:**
+{chunk}
+"""
+
+# ==============================================================================
+# PROMPT 10: BATCHED SUB-QUESTION ANSWERS
+# ==============================================================================
+BATCH_ANSWER_PROMPT = """
+You are a precise, professional document analysis bot. Answer each numbered question using ONLY the numbered evidence lines.
+
+**TASK:**
+1.  Return a JSON array with exactly one answer string per question, in the same order as the questions.
+2.  When you use a piece of evidence, cite its number in brackets, like `[1]` or `[1][3]`.
+3.  If the evidence does not answer a question, say so in that question's answer. Do not add outside knowledge.
+
+---
+**Questions:**
+{questions}
+---
+**Evidence:**
+{context_str}
+"""
 
-**Your JSON Output:**
-"""
\ No newline at end of file
+# ==============================================================================
+# IMPORT-TIME NORMALIZATION
+# ==============================================================================
+# The prompts are written for readability. Before use they are squeezed once: trailing spaces,
+# blank-line runs, full-line **header** bolding and double-spaced list numbering all cost tokens
+# on every call without changing what the model is asked to do. Inline bold is kept.
+_HEADER_BOLD_RE = re.compile(r"^\*\*(.+?)\*\*$", re.MULTILINE)
+_LIST_NUMBER_RE = re.compile(r"^(\d+\.) {2,}", re.MULTILINE)
+_BLANK_RUN_RE = re.compile(r"\n{3,}")
+
+
+def _normalize(prompt: str) -> str:
+    text = "\n".join(line.rstrip() for line in prompt.strip().splitlines())
+    text = _HEADER_BOLD_RE.sub(r"\1", text)
+    text = _LIST_NUMBER_RE.sub(r"\1 ", text)
+    return _BLANK_RUN_RE.sub("\n\n", text) + "\n"
+
+
+QUERY_CLASSIFICATION_PROMPT_V2 = _normalize(QUERY_CLASSIFICATION_PROMPT_V2)
+CYPHER_GENERATION_PROMPT = _normalize(CYPHER_GENERATION_PROMPT)
+REASONING_SYNTHESIS_PROMPT = _normalize(REASONING_SYNTHESIS_PROMPT)
+DIRECT_SYNTHESIS_PROMPT = _normalize(DIRECT_SYNTHESIS_PROMPT)
+SUMMARIZATION_PROMPT = _normalize(SUMMARIZATION_PROMPT)
+RERANKING_SYSTEM_INSTRUCTION = _normalize(RERANKING_SYSTEM_INSTRUCTION)
+RERANKING_TASK_TEMPLATE = _normalize(RERANKING_TASK_TEMPLATE)
+QUERY_PLANNING_PROMPT = _normalize(QUERY_PLANNING_PROMPT)
+MAP_SUMMARY_PROMPT = _normalize(MAP_SUMMARY_PROMPT)
+BATCH_ANSWER_PROMPT = _normalize(BATCH_ANSWER_PROMPT)
+
+# ==============================================================================
+# FIELD TOKEN BUDGETS
+# ==============================================================================
+# Upper bounds for the fields that grow with retrieval results or conversation length. There is no
+# local Gemini tokenizer, so a token is approximated as 4 characters (generous for English prose).
+CHARS_PER_TOKEN = 4
+FIELD_TOKEN_BUDGETS = {
+    "scratchpad": 2000,
+    "context_str": 6000,
+    "chat_history": 1000,
+    "documents": 4000,
+}
+TRUNCATION_MARKER = "...[truncated]..."
+# The newest turns are at the end of the history, so it is cut from the front; everything else keeps its start.
+_KEEP_TAIL_FIELDS = frozenset({"chat_history"})
+
+
+def truncate_field(name: str, value: str) -> str:
+    """Cuts `value` to the budget for field `name` at a line boundary where possible, marking the cut."""
+    budget = FIELD_TOKEN_BUDGETS.get(name)
+    if budget is None or len(value) <= budget * CHARS_PER_TOKEN:
+        return value
+    max_chars = budget * CHARS_PER_TOKEN
+    logger.warning(f"Prompt field '{name}' truncated from {len(value)} to ~{max_chars} characters.")
+    if name in _KEEP_TAIL_FIELDS:
+        kept = value[-max_chars:]
+        cut = kept.find("\n")
+        if 0 <= cut < max_chars // 2:
+            kept = kept[cut + 1:]
+        return f"{TRUNCATION_MARKER}\n{kept}"
+    kept = value[:max_chars]
+    cut = kept.rfind("\n")
+    if cut > max_chars // 2:
+        kept = kept[:cut]
+    return f"{kept}\n{TRUNCATION_MARKER}"
+
+
+# ==============================================================================
+# PRE-COMPILED RENDERERS
+# ==============================================================================
+# Each template is split into literal chunks and field names once at import, so rendering a
+# prompt is a single join instead of a `str.format` scan of the whole template per request.
+# `string.Formatter.parse` un-escapes the doubled braces used in the JSON examples.
+# Fields listed in FIELD_TOKEN_BUDGETS are truncated as they are rendered.
+
+def _compile(template: str) -> Callable[..., str]:
+    parsed = list(Formatter().parse(template))
+    literals = [literal for literal, _, _, _ in parsed]
+    names = [name for _, name, _, _ in parsed]
+    budgeted = [name in FIELD_TOKEN_BUDGETS for name in names]
+
+    def render(**values) -> str:
+        out = []
+        for literal, name, is_budgeted in zip(literals, names, budgeted):
+            out.append(literal)
+            if name is not None:
+                value = str(values[name])
+                out.append(truncate_field(name, value) if is_budgeted else value)
+        return "".join(out)
+
+    return render
+
+
+render_cypher_generation = _compile(CYPHER_GENERATION_PROMPT)
+render_reasoning_synthesis = _compile(REASONING_SYNTHESIS_PROMPT)
+render_direct_synthesis = _compile(DIRECT_SYNTHESIS_PROMPT)
+render_summarization = _compile(SUMMARIZATION_PROMPT)
+render_reranking = _compile(RERANKING_TASK_TEMPLATE)
+render_map_summary = _compile(MAP_SUMMARY_PROMPT)
+render_batch_answer = _compile(BATCH_ANSWER_PROMPT)
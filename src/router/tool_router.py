@@ -1,7 +1,9 @@
 # FILE: src/router/tool_router.py
+# V5.1 (Concurrent Dispatch): Tools can be submitted to a shared pool so independent calls overlap.
 # V5.0 (Unified Tooling): Refactored to use only the two primary tools.
 
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Callable, Dict
 
 from src.models import QueryMetadata, ToolResult
@@ -9,6 +11,9 @@ from src.tools import retrievers
 
 logger = logging.getLogger(__name__)
 
+# Both tools are network-bound (Pinecone, Neo4j, Gemini), so threads overlap them without contention.
+TOOL_POOL_WORKERS = 8
+
 class ToolRouter:
     def __init__(self):
         # --- DEFINITIVE FIX: Register only the tools that now exist ---
@@ -16,8 +21,13 @@ class ToolRouter:
             "vector_search": retrievers.vector_search,
             "query_knowledge_graph": retrievers.query_knowledge_graph,
         }
+        self._pool = ThreadPoolExecutor(max_workers=TOOL_POOL_WORKERS, thread_name_prefix="tool")
         logger.info(f"ToolRouter initialized with {len(self.registry)} tools.")
 
+    def submit_tool(self, tool_name: str, query: str, query_meta: QueryMetadata) -> "Future[ToolResult]":
+        """Starts `execute_tool` on the router's pool. The future never raises; failures come back as a ToolResult."""
+        return self._pool.submit(self.execute_tool, tool_name, query, query_meta)
+
     def execute_tool(self, tool_name: str, query: str, query_meta: QueryMetadata) -> ToolResult:
         logger.info(f"[ToolRouter] Executing tool: '{tool_name}'")
         tool_function = self.registry.get(tool_name)
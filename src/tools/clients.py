@@ -1,9 +1,12 @@
 # FILE: src/tools/clients.py
-# V3.0 (Final Version): Removed all unnecessary Cohere client code.
+# V3.2 (Graph Indexes): The driver getter makes sure the indexes behind generated Cypher lookups exist.
+# V3.1: Environment settings are read once into a frozen Settings object.
 
 import os
 import logging
+from dataclasses import dataclass
 from functools import lru_cache
+from typing import Optional
 
 import pinecone
 import neo4j
@@ -17,6 +20,30 @@ from dotenv import load_dotenv
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# --- Environment Settings ---
+@dataclass(frozen=True, slots=True)
+class Settings:
+    GOOGLE_API_KEY: Optional[str]
+    PINECONE_API_KEY: Optional[str]
+    PINECONE_INDEX_NAME: Optional[str]
+    NEO4J_URI: Optional[str]
+    NEO4J_USERNAME: str
+    NEO4J_PASSWORD: Optional[str]
+    CACHE_DIR: str
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Reads the environment exactly once. Tests can call `get_settings.cache_clear()` after patching env vars."""
+    return Settings(
+        GOOGLE_API_KEY=os.getenv("GOOGLE_API_KEY"),
+        PINECONE_API_KEY=os.getenv("PINECONE_API_KEY"),
+        PINECONE_INDEX_NAME=os.getenv("PINECONE_INDEX_NAME"),
+        NEO4J_URI=os.getenv("NEO4J_URI"),
+        NEO4J_USERNAME=os.getenv("NEO4J_USERNAME", "neo4j"),
+        NEO4J_PASSWORD=os.getenv("NEO4J_PASSWORD"),
+        CACHE_DIR=os.getenv("PERSONA_RAG_CACHE_DIR", "/tmp/persona_rag_cache"),
+    )
+
 # --- Resilience Configuration ---
 def is_service_unavailable(exc: Exception) -> bool:
     """Predicate function to check if an exception is a ServiceUnavailable error."""
@@ -32,6 +59,40 @@ DEFAULT_RETRY = Retry(
 
 DEFAULT_REQUEST_OPTIONS = {"retry": DEFAULT_RETRY, "timeout": 15.0}
 
+# Planner calls (classification, rewriting) produce a handful of tokens, so a stalled call is
+# cut off early and retried fresh instead of waiting out the slow default backoff.
+def is_retryable_fast_call(exc: Exception) -> bool:
+    """Retries unavailable services and per-attempt timeouts."""
+    return isinstance(exc, (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded))
+
+FAST_RETRY = Retry(
+    predicate=is_retryable_fast_call,
+    initial=0.5,
+    maximum=2.0,
+    multiplier=2.0,
+    deadline=10.0,
+)
+
+CLASSIFIER_REQUEST_OPTIONS = {"retry": FAST_RETRY, "timeout": 5.0}
+
+# The persona fallback is acceptable, so this call gives up sooner still: at most one quick retry
+# of the 2-second attempt within a 2.5-second budget, instead of FAST_RETRY's 10-second deadline.
+PERSONA_RETRY = Retry(
+    predicate=is_retryable_fast_call,
+    initial=0.25,
+    maximum=0.5,
+    multiplier=2.0,
+    deadline=2.5,
+)
+PERSONA_REQUEST_OPTIONS = {"retry": PERSONA_RETRY, "timeout": 2.0}
+
+# Expected failures under API degradation; callers log these without a stack trace.
+TRANSIENT_LLM_ERRORS = (
+    google_exceptions.RetryError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
 
 # --- Client Initializers (Cached for Performance) ---
 
@@ -39,7 +100,7 @@ DEFAULT_REQUEST_OPTIONS = {"retry": DEFAULT_RETRY, "timeout": 15.0}
 def get_google_ai_client() -> genai:
     """Initializes and returns the Google AI client."""
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
+        api_key = get_settings().GOOGLE_API_KEY
         if not api_key:
             raise ValueError("GOOGLE_API_KEY environment variable not set.")
         genai.configure(api_key=api_key)
@@ -65,12 +126,55 @@ def get_flash_model(model_name: str = 'gemini-1.5-flash-latest') -> genai.Genera
     logger.info(f"Requesting Flash Model: {model_name}")
     return client.GenerativeModel(model_name)
 
+@lru_cache(maxsize=8)
+def get_instructed_flash_model(system_instruction: str, model_name: str = 'gemini-1.5-flash-latest') -> genai.GenerativeModel:
+    """
+    Flash model with a fixed system instruction. The constant part of a planner prompt is bound
+    here once, so each request carries only its variable suffix. One instance per instruction.
+    """
+    client = get_google_ai_client()
+    if not client: return None
+    logger.info(f"Requesting instructed Flash Model: {model_name}")
+    return client.GenerativeModel(model_name, system_instruction=system_instruction)
+
+@lru_cache(maxsize=1)
+def get_sentence_encoder(model_name: str = 'all-MiniLM-L6-v2'):
+    """Loads the local SentenceTransformer used for semantic caching. Returns None if unavailable."""
+    try:
+        # Imported lazily: torch is heavy and only needed once a semantic cache is used.
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer(model_name)
+        logger.info(f"SentenceTransformer '{model_name}' loaded successfully.")
+        return encoder
+    except Exception as e:
+        logger.error(f"Failed to load SentenceTransformer '{model_name}': {e}")
+        return None
+
+# Snippets are a few hundred tokens; capping the pair length bounds the cost of the odd oversized chunk.
+CROSS_ENCODER_MAX_LENGTH = 512
+
+@lru_cache(maxsize=1)
+def get_cross_encoder(model_name: str = 'BAAI/bge-reranker-v2-m3'):
+    """Loads the local cross-encoder used for re-ranking. Returns None if unavailable, so callers can fall back to Gemini."""
+    try:
+        from sentence_transformers import CrossEncoder
+        encoder = CrossEncoder(model_name, max_length=CROSS_ENCODER_MAX_LENGTH)
+        # Half precision roughly doubles GPU throughput with no effect on the ranking.
+        if str(encoder.model.device).startswith("cuda"):
+            encoder.model.half()
+        logger.info(f"CrossEncoder '{model_name}' loaded successfully on {encoder.model.device}.")
+        return encoder
+    except Exception as e:
+        logger.error(f"Failed to load CrossEncoder '{model_name}': {e}")
+        return None
+
 @lru_cache(maxsize=1)
 def get_pinecone_index() -> pinecone.Index:
     """Initializes and returns the Pinecone index client."""
     try:
-        api_key = os.getenv("PINECONE_API_KEY")
-        index_name = os.getenv("PINECONE_INDEX_NAME")
+        settings = get_settings()
+        api_key = settings.PINECONE_API_KEY
+        index_name = settings.PINECONE_INDEX_NAME
         if not api_key or not index_name:
             raise ValueError("PINECONE_API_KEY or PINECONE_INDEX_NAME not set.")
         
@@ -82,18 +186,37 @@ def get_pinecone_index() -> pinecone.Index:
         logger.error(f"Failed to connect to Pinecone index: {e}")
         return None
 
+# Generated Cypher anchors on `Entity.name_normalized`, with `=` for names and CONTAINS for
+# indications. The range index serves equality and the text index serves CONTAINS, so neither
+# falls back to scanning every Entity node.
+GRAPH_INDEX_STATEMENTS = (
+    "CREATE RANGE INDEX entity_name_normalized_range IF NOT EXISTS FOR (n:Entity) ON (n.name_normalized)",
+    "CREATE TEXT INDEX entity_name_normalized_text IF NOT EXISTS FOR (n:Entity) ON (n.name_normalized)",
+)
+
+def _ensure_graph_indexes(driver: neo4j.Driver) -> None:
+    """Creates any missing lookup index. A user without schema rights only gets a warning."""
+    try:
+        with driver.session() as session:
+            for statement in GRAPH_INDEX_STATEMENTS:
+                session.run(statement).consume()
+    except Exception as e:
+        logger.warning(f"Could not ensure Neo4j indexes: {e}")
+
 @lru_cache(maxsize=1)
 def get_neo4j_driver() -> neo4j.Driver:
     """Initializes and returns the Neo4j graph database driver."""
     try:
-        uri = os.getenv("NEO4J_URI")
-        user = os.getenv("NEO4J_USERNAME", "neo4j")
-        password = os.getenv("NEO4J_PASSWORD")
+        settings = get_settings()
+        uri = settings.NEO4J_URI
+        user = settings.NEO4J_USERNAME
+        password = settings.NEO4J_PASSWORD
         if not all([uri, user, password]):
             raise ValueError("Neo4j connection details (URI, USERNAME, PASSWORD) not set.")
 
         driver = neo4j.GraphDatabase.driver(uri, auth=(user, password))
         driver.verify_connectivity()
+        _ensure_graph_indexes(driver)
         logger.info("Neo4j driver connected successfully.")
         return driver
     except Exception as e:
@@ -0,0 +1,99 @@
+# FILE: src/tools/cypher_examples.py
+# V1.3 (Schema-Shaped Params): Example params are name/value pairs, the same shape the response schema requires.
+# V1.2 (Intent-Aware): Examples whose query shape does not fit the classified intent are ranked last.
+# V1.1 (Parameterized): Examples carry a `params` map; literal values never appear in the Cypher text.
+# V1.0: Few-shot example index for Cypher generation. The examples most similar to the
+# question are injected into the prompt instead of a fixed gallery.
+
+import json
+import logging
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from src.tools.clients import get_sentence_encoder
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+CYPHER_EXAMPLES_FILE = PROJECT_ROOT / "config" / "cypher_examples.jsonl"
+DEFAULT_EXAMPLE_COUNT = 2
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Whether an intent calls for the batched `UNWIND $entities` shape. Intents not listed here rank
+# examples by similarity alone.
+INTENT_WANTS_BATCHED = {
+    "specific_fact_lookup": False,
+    "comparative_analysis": True,
+}
+
+
+class CypherExample(NamedTuple):
+    question: str
+    cypher: str
+    entities: Optional[List[str]] = None
+    params: Optional[List[Dict[str, str]]] = None
+
+
+class CypherExampleIndex:
+    """
+    Ranks curated (question, cypher) pairs by similarity to a new question. Uses the local
+    sentence encoder when it is available and falls back to token-overlap (Jaccard) scoring.
+    """
+
+    def __init__(self, examples: List[CypherExample]):
+        self.examples = examples
+        self._token_sets = [set(_TOKEN_RE.findall(example.question.lower())) for example in examples]
+        self._is_batched = np.array([bool(example.entities) for example in examples], dtype=bool)
+        self._encoder = get_sentence_encoder()
+        self._vectors = None
+        if self._encoder is not None and examples:
+            self._vectors = self._encoder.encode(
+                [example.question for example in examples], normalize_embeddings=True, convert_to_numpy=True
+            ).astype(np.float32)
+
+    def search(self, question: str, k: int = DEFAULT_EXAMPLE_COUNT, intent: Optional[str] = None) -> List[CypherExample]:
+        if not self.examples:
+            return []
+        if self._vectors is not None:
+            query_vector = self._encoder.encode(question, normalize_embeddings=True, convert_to_numpy=True)
+            scores = self._vectors @ query_vector.astype(np.float32)
+        else:
+            tokens = set(_TOKEN_RE.findall(question.lower()))
+            scores = np.array([len(tokens & ex) / (len(tokens | ex) or 1) for ex in self._token_sets])
+        wants_batched = INTENT_WANTS_BATCHED.get(intent)
+        if wants_batched is not None:
+            # Off-shape examples only fill the gallery when too few on-shape ones exist.
+            scores = np.where(self._is_batched == wants_batched, scores, scores - 2.0)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [self.examples[i] for i in top]
+
+    def format_examples(self, question: str, k: int = DEFAULT_EXAMPLE_COUNT, intent: Optional[str] = None) -> str:
+        """Renders the top-k examples in the prompt's `Question: / Cypher: / Params: / Entities:` layout."""
+        blocks = []
+        for i, example in enumerate(self.search(question, k, intent), start=1):
+            block = f'# Example {i}\nQuestion: "{example.question}"\nCypher: {example.cypher}'
+            if example.params:
+                block += f"\nParams: {json.dumps(example.params)}"
+            if example.entities:
+                block += f"\nEntities: {json.dumps(example.entities)}"
+            blocks.append(block)
+        return "\n\n".join(blocks)
+
+
+@lru_cache(maxsize=1)
+def get_cypher_example_index() -> CypherExampleIndex:
+    """Loads the example file and builds the index once per process; an unreadable file yields an empty index."""
+    examples = []
+    try:
+        with open(CYPHER_EXAMPLES_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    examples.append(CypherExample(record["question"], record["cypher"], record.get("entities"), record.get("params")))
+        logger.info(f"Loaded {len(examples)} Cypher examples from '{CYPHER_EXAMPLES_FILE}'.")
+    except Exception as e:
+        logger.error(f"Could not load Cypher examples from '{CYPHER_EXAMPLES_FILE}': {e}", exc_info=True)
+    return CypherExampleIndex(examples)
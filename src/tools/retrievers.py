@@ -1,43 +1,189 @@
 # FILE: src/tools/retrievers.py
+# V7.5 (Directed Graph Evidence): Each relationship is serialized from its own start/end node; multi-hop rows are labelled as paths.
+# V7.4 (Graph Gate): The KG tool refuses non-graph-suitable queries before any LLM call; Cypher replies are also kept in memory.
+# V7.3 (Capped Graph Results): Neo4j records are streamed and cut off at GRAPH_RESULT_LIMIT instead of fully buffered.
+# V7.2 (Batched Query Embeddings): Sub-questions are embedded in one background call that vector_search waits on.
+# V7.1 (Vector Search Cache): Exact repeats, and near-duplicates naming the same entities, reuse recent Pinecone results without an embed or query call.
+# V7.0 (Persistent Cypher Cache): Cypher replies that ran successfully are stored in the disk cache, keyed on model and full prompt.
+# V6.9 (Background Schema Refresh): An expired schema snapshot is served while a background thread re-introspects Neo4j.
+# V6.8 (Intent-Aware Examples): The classified intent steers which Cypher examples fill the gallery.
+# V6.7 (Schema-Only Parsing): The Cypher reply is read as the schema's JSON object; fence/prose extraction is gone.
+# V6.6 (Parameterized Cypher): Values travel as query parameters, so Neo4j reuses one plan per query shape.
+# V6.5 (Schema Snapshot): The formatted graph schema is cached for SCHEMA_TTL_SEC instead of introspected per query.
 # V6.4 (Enhanced Schema Introspection): Upgrades the schema generation for the
 # Cypher prompt. It now dynamically fetches and includes relationship properties,
 # giving the LLM the necessary context to write correct queries that filter on
 # relationship attributes like date and source.
 
+import json
 import logging
+import re
+import threading
+from itertools import islice
 import time
-from typing import List, Dict, Any
+from concurrent.futures import Future
+from typing import List, Dict, Any, Tuple
 import neo4j
+from cachetools import LRUCache, TTLCache
 import google.generativeai as genai
 
-from src.tools.clients import get_flash_model, get_pinecone_index, get_neo4j_driver, DEFAULT_REQUEST_OPTIONS
+from src.tools.clients import get_flash_model, get_generative_model, get_pinecone_index, get_neo4j_driver, DEFAULT_REQUEST_OPTIONS
 from src.models import ToolResult, QueryMetadata
-from src.prompts import CYPHER_GENERATION_PROMPT
+from src.common.disk_cache import get_disk_cache, make_cache_key
+from src.common.semantic_cache import SemanticCache
+from src.common.utils import normalize_query
+from src.prompts import render_cypher_generation
+from src.tools.cypher_examples import get_cypher_example_index
 
 logger = logging.getLogger(__name__)
 
+# Gemini returns {"cypher": ..., "params": [...], "entities": [...]} under this schema, so the reply never
+# carries prose, fences or a preamble around the query. `NONE` in `cypher` means "not answerable".
+# Response schemas cannot express a free-form map, so parameters come back as name/value pairs.
+CYPHER_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {
+            "cypher": {"type": "string"},
+            "params": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"name": {"type": "string"}, "value": {"type": "string"}},
+                    "required": ["name", "value"],
+                },
+            },
+            "entities": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["cypher"],
+    },
+    "temperature": 0.0,
+}
+
+# Generated queries rarely carry a LIMIT. More triples than this would not survive re-ranking anyway.
+GRAPH_RESULT_LIMIT = 50
+
+# Quoted string literals left in generated Cypher. They are moved into parameters before the query
+# runs, so the query text (and Neo4j's cached plan) depends only on the query's shape.
+_STRING_LITERAL_RE = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"")
+
+# Used only when the Flash model's Cypher cannot be parsed or is rejected by Neo4j.
+CYPHER_FALLBACK_MODEL = 'gemini-1.5-pro-latest'
+
+# The graph schema changes only when the ingestion pipeline runs, so one snapshot serves all
+# queries for a few minutes. A stable schema string also keeps the Cypher prompt prefix identical.
+SCHEMA_TTL_SEC = 300
+# Only the very first Cypher query waits for introspection. After that, an expired snapshot keeps
+# being served while one background thread rebuilds it, and a failed rebuild keeps the old one.
+_schema_snapshot: Dict[str, Any] = {"schema": None, "fetched_at": 0.0, "refreshing": False}
+_schema_lock = threading.Lock()
+
+# Readable phrases for the graph's relationship types, so a serialized triple reads as a sentence.
+_PREDICATE_PHRASES = {
+    "HASSPONSOR": "has sponsor",
+    "HASINDICATION": "has indication",
+    "HASTRADENAME": "has trade name",
+    "HASSUBMISSIONTYPE": "has submission type",
+}
+
 # ... (Timer class and _format_pinecone_results are unchanged) ...
 class Timer:
     def __init__(self, name): self.name = name
     def __enter__(self): self.start = time.perf_counter(); return self
     def __exit__(self, *args): self.end = time.perf_counter(); logger.info(f"[TIMER] {self.name} took {(self.end - self.start) * 1000:.2f} ms")
 
+# Pinecone results per (namespace, theme filter, entities, query). Entries expire so newly ingested
+# chunks show up within VECTOR_CACHE_TTL_SEC. A paraphrase above the similarity threshold reuses the
+# same results only when it names the same entities: questions that differ just in the drug score
+# well above the threshold but need different evidence.
+VECTOR_CACHE_TTL_SEC = 600
+VECTOR_CACHE_MAX_SIZE = 4096
+_vector_exact_cache = TTLCache(maxsize=VECTOR_CACHE_MAX_SIZE, ttl=VECTOR_CACHE_TTL_SEC)
+_vector_exact_lock = threading.Lock()
+_vector_semantic_cache = SemanticCache(threshold=0.95, maxsize=VECTOR_CACHE_MAX_SIZE)
+
+def _vector_cache_scope(namespace: str, query_meta: QueryMetadata) -> Tuple:
+    themes = tuple(sorted(query_meta.themes)) if query_meta and query_meta.themes else ()
+    entities = tuple(sorted({normalize_query(k) for k in query_meta.keywords})) if query_meta and query_meta.keywords else ()
+    return namespace, themes, entities
+
+def _get_cached_vector_results(scope: Tuple, query: str) -> Tuple[Any, Any]:
+    """Returns (content, query_vector). The local encode only runs after an exact miss; the vector is reused by the put."""
+    with _vector_exact_lock:
+        content = _vector_exact_cache.get((scope, normalize_query(query)))
+    if content is not None:
+        logger.info("Vector search cache hit (exact).")
+        return content, None
+    query_vector = _vector_semantic_cache.embed(query)
+    entry = _vector_semantic_cache.get(query_vector)
+    # A semantic hit must share namespace, filter and entities, and be no older than an exact entry.
+    if entry and entry[0] == scope and time.monotonic() - entry[1] <= VECTOR_CACHE_TTL_SEC:
+        return entry[2], query_vector
+    return None, query_vector
+
+def _put_cached_vector_results(scope: Tuple, query: str, query_vector, content: str) -> None:
+    with _vector_exact_lock:
+        _vector_exact_cache[(scope, normalize_query(query))] = content
+    _vector_semantic_cache.put(query_vector, (scope, time.monotonic(), content))
+
+# Embeddings requested ahead of time by prefetch_query_embeddings, keyed on the normalized query.
+# vector_search takes the finished vector (or waits for the in-flight batch) instead of its own embed call.
+# Entries that are never consumed (cache hits, KG answers) are bounded by the LRU.
+EMBEDDING_MODEL = 'models/text-embedding-004'
+_pending_embeddings: LRUCache = LRUCache(maxsize=256)
+_pending_embeddings_lock = threading.Lock()
+
+def _embed_batch(queries: List[str], futures: List[Future]) -> None:
+    try:
+        response = genai.embed_content(model=EMBEDDING_MODEL, content=queries, task_type="retrieval_query")
+        for future, embedding in zip(futures, response['embedding']):
+            future.set_result(embedding)
+    except Exception as e:
+        logger.warning(f"Batched query embedding failed; queries will be embedded individually: {e}")
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+
+def prefetch_query_embeddings(queries: List[str]) -> None:
+    """Embeds all `queries` in one background call. Later vector searches for them reuse the result."""
+    # Futures are keyed by the normalized text, but the original text is what gets embedded, so a
+    # prefetched vector is identical to the one vector_search would compute itself.
+    originals = {}
+    for query in queries:
+        originals.setdefault(normalize_query(query), query)
+    if len(originals) < 2:
+        return
+    futures = [Future() for _ in originals]
+    with _pending_embeddings_lock:
+        for key, future in zip(originals, futures):
+            _pending_embeddings[key] = future
+    threading.Thread(target=_embed_batch, args=(list(originals.values()), futures), name="query-embedding-batch", daemon=True).start()
+
+def _get_query_embedding(query: str) -> List[float]:
+    with _pending_embeddings_lock:
+        future = _pending_embeddings.pop(normalize_query(query), None)
+    if future is not None:
+        try:
+            return future.result()
+        except Exception:
+            pass
+    return genai.embed_content(model=EMBEDDING_MODEL, content=query, task_type="retrieval_query")['embedding']
+
+MAX_PAGES_TO_SHOW = 4
+
 def _format_pinecone_results(matches: List[dict]) -> List[str]:
     contents = []
-    MAX_PAGES_TO_SHOW = 4
-
     for match in matches:
-        metadata = match.get('metadata', {})
-        text = metadata.get('text', 'No content available.')
-        doc_id = metadata.get('doc_id', 'Unknown Document')
-        page_numbers_raw = metadata.get('page_numbers', [])
-        url = metadata.get('source_pdf_url', '#')
+        mget = match.get('metadata', {}).get
+        text, doc_id = mget('text', 'No content available.'), mget('doc_id', 'Unknown Document')
+        page_numbers_raw, url = mget('page_numbers', []), mget('source_pdf_url', '#')
         
         page_str, link_url = "N/A", url
 
         if page_numbers_raw and all(isinstance(p, (str, int, float)) for p in page_numbers_raw):
             try:
-                unique_pages = sorted(list(set(map(int, page_numbers_raw))))
+                unique_pages = sorted(set(map(int, page_numbers_raw)))
                 
                 if len(unique_pages) > MAX_PAGES_TO_SHOW:
                     page_str = f"Pages {', '.join(map(str, unique_pages[:MAX_PAGES_TO_SHOW]))}, ..."
@@ -53,30 +199,170 @@ def _format_pinecone_results(matches: List[dict]) -> List[str]:
         contents.append(f"Evidence from document: {text}\nCitation: {citation}")
     return contents
 
+def _serialize_relationship(rel) -> str:
+    """One sentence per relationship, read from its own start and end node, so a pattern written
+    right-to-left (`(a)<-[:R]-(b)`) still states the fact in the stored direction."""
+    subject_name, object_name = rel.start_node.get('name'), rel.end_node.get('name')
+    if not all([subject_name, rel.type, object_name]): return ""
+    predicate_str = _PREDICATE_PHRASES.get(rel.type) or rel.type.replace('_', ' ').lower()
+    return f"{subject_name} {predicate_str} {object_name}."
+
 def _serialize_neo4j_path(record: Dict[str, Any]) -> str:
-    # ... (This function is unchanged) ...
+    """Renders one result row. Single-hop rows are labelled `graph`, multi-hop rows `graph path`."""
     path_data, rel_props = record.get("p"), record.get("rel_props")
-    if not path_data: return ""
-    subject_name, predicate_type, object_name = None, None, None
+    if not isinstance(path_data, neo4j.graph.Path) or not path_data.relationships: return ""
     try:
-        if isinstance(path_data, neo4j.graph.Path):
-            subject_name, predicate_type, object_name = path_data.start_node.get('name'), path_data.relationships[0].type, path_data.end_node.get('name')
-        elif isinstance(path_data, list) and len(path_data) == 3:
-            subject_name, predicate_type, object_name = path_data[0].get('name'), path_data[1], path_data[2].get('name')
-        if not all([subject_name, predicate_type, object_name]): return ""
-        predicate_str = predicate_type.replace('_', ' ').lower()
-        text_representation = f"{subject_name} {predicate_str} {object_name}."
+        sentences = [_serialize_relationship(rel) for rel in path_data.relationships]
+        if not all(sentences): return ""
+        text_representation = " ".join(sentences)
+        label = "graph" if len(sentences) == 1 else "graph path"
         citation_text, link_url = "Knowledge Graph", "#"
         if isinstance(rel_props, dict):
             doc_id, url, page_num = rel_props.get('doc_id'), rel_props.get('source_pdf_url'), rel_props.get('page_numbers', 'N/A')
             if doc_id: citation_text = f"{doc_id} (Page {page_num})"
             if url: link_url = f"{url}#page={str(page_num).split(',')[0]}"
         citation = f'<a href="{link_url}" target="_blank">{citation_text}</a>'
-        return f"Evidence from graph: {text_representation}\nCitation: {citation}"
+        return f"Evidence from {label}: {text_representation}\nCitation: {citation}"
     except Exception as e:
         logger.warning(f"Could not serialize Neo4j path: {e}")
         return ""
 
+class UnusableCypherError(ValueError):
+    """The model produced neither a runnable query nor the NONE sentinel."""
+
+
+def _parse_cypher_response(text: str) -> Tuple[str, Dict[str, Any]]:
+    """Reads the schema-constrained reply into a Cypher query and its parameters (including a batched `$entities` list)."""
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise UnusableCypherError(f"Cypher reply is not JSON: {text[:80]!r}") from e
+    if not isinstance(payload, dict):
+        raise UnusableCypherError(f"Cypher reply is not a JSON object: {text[:80]!r}")
+    raw_params = payload.get("params") or []
+    params = {p["name"].lstrip("$"): p["value"] for p in raw_params if isinstance(p, dict) and p.get("name")}
+    if payload.get("entities"):
+        params["entities"] = payload["entities"]
+    return payload.get("cypher", "").strip(), params
+
+def _lift_string_literals(cypher_query: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Replaces quoted literals with `$lit<n>` parameters, so the same query shape always has the same text."""
+    if "'" not in cypher_query and '"' not in cypher_query:
+        return cypher_query, params
+    lifted = dict(params)
+
+    def to_param(match: re.Match) -> str:
+        name = f"lit{len(lifted)}"
+        while name in lifted:
+            name += "_"
+        raw = match.group(1) if match.group(1) is not None else match.group(2)
+        lifted[name] = re.sub(r"\\(.)", r"\1", raw)
+        return f"${name}"
+
+    return _STRING_LITERAL_RE.sub(to_param, cypher_query), lifted
+
+def _is_executable_cypher(cypher_query: str) -> bool:
+    """Checks only the leading window of the query for the NONE sentinel and a MATCH clause."""
+    head = cypher_query[:64].upper()
+    return not head.startswith("NONE") and "MATCH" in head
+
+def _build_schema_string(driver) -> str:
+    with driver.session() as session:
+        nodes_schema = session.run("CALL db.schema.nodeTypeProperties()").data()
+        rels_schema = session.run("CALL db.schema.relTypeProperties()").data()
+
+    schema_str = "Node Properties:\n"
+    for node in nodes_schema:
+        # --- START OF DEFINITIVE FIX ---
+        # The correct key for the property name is 'propertyName'.
+        prop_name = node['propertyName']
+        prop_type = node['propertyTypes'][0] # It's a list, take the first
+        schema_str += f"- Label: {node['nodeLabels'][0]}, Properties: {prop_name}: {prop_type}\n"
+        # --- END OF DEFINITIVE FIX ---
+
+    schema_str += "\nRelationship Properties:\n"
+    for rel in rels_schema:
+        rel_type = rel.get('relType', '').strip('`')
+        properties = rel.get('properties', [])
+        props_list = [f"{p['property']}: {p['type']}" for p in properties]
+        props_str = ", ".join(props_list)
+        schema_str += f"- (:Entity)-[:{rel_type} {{{props_str}}}]->(:Entity)\n"
+    return schema_str
+
+def _refresh_schema_snapshot(driver) -> None:
+    try:
+        schema_str = _build_schema_string(driver)
+        with _schema_lock:
+            if schema_str != _schema_snapshot["schema"]:
+                logger.info("Neo4j schema changed; snapshot updated.")
+            _schema_snapshot["schema"] = schema_str
+            _schema_snapshot["fetched_at"] = time.monotonic()
+    except Exception as e:
+        logger.warning(f"Neo4j schema refresh failed, keeping the previous snapshot: {e}")
+    finally:
+        with _schema_lock:
+            _schema_snapshot["refreshing"] = False
+
+def _get_schema_string(driver) -> str:
+    """Returns the formatted graph schema. Neo4j is introspected synchronously only when no snapshot exists yet."""
+    with _schema_lock:
+        schema_str = _schema_snapshot["schema"]
+        if schema_str is None:
+            schema_str = _build_schema_string(driver)
+            _schema_snapshot["schema"] = schema_str
+            _schema_snapshot["fetched_at"] = time.monotonic()
+            logger.info("Loaded Neo4j schema snapshot.")
+            return schema_str
+        if time.monotonic() - _schema_snapshot["fetched_at"] > SCHEMA_TTL_SEC and not _schema_snapshot["refreshing"]:
+            _schema_snapshot["refreshing"] = True
+            threading.Thread(target=_refresh_schema_snapshot, args=(driver,), name="neo4j-schema-refresh", daemon=True).start()
+        return schema_str
+
+# In-process layer in front of the disk cache for Cypher replies, keyed the same way.
+_cypher_reply_cache = LRUCache(maxsize=1024)
+_cypher_reply_lock = threading.Lock()
+
+def _remember_cypher_reply(disk_cache, key: str, reply: str) -> None:
+    with _cypher_reply_lock:
+        _cypher_reply_cache[key] = reply
+    if disk_cache:
+        disk_cache.set(key, reply)
+
+def _generate_and_run_cypher(llm, prompt: str, driver) -> List[dict]:
+    """Generates Cypher with `llm` and runs it. Returns [] when the model answers NONE."""
+    # Generation runs at temperature 0 and the prompt embeds the schema snapshot and examples, so
+    # the same (model, prompt) pair yields the same reply across restarts and workers.
+    cacheable = CYPHER_GENERATION_CONFIG["temperature"] == 0
+    disk_cache = get_disk_cache() if cacheable else None
+    disk_key = make_cache_key("cypher_generation", getattr(llm, "model_name", ""), prompt)
+    with _cypher_reply_lock:
+        reply = _cypher_reply_cache.get(disk_key) if cacheable else None
+    if reply is None and disk_cache:
+        reply = disk_cache.get(disk_key)
+        if reply is not None:
+            logger.info("Cypher generation disk cache hit.")
+    if reply is None:
+        reply = llm.generate_content(prompt, generation_config=CYPHER_GENERATION_CONFIG, request_options=DEFAULT_REQUEST_OPTIONS).text
+    cypher_query, cypher_params = _parse_cypher_response(reply)
+    if cypher_query[:64].upper().startswith("NONE"):
+        if cacheable:
+            _remember_cypher_reply(disk_cache, disk_key, reply)
+        return []
+    if not _is_executable_cypher(cypher_query):
+        raise UnusableCypherError(f"unusable Cypher output: {cypher_query[:80]!r}")
+    cypher_query, cypher_params = _lift_string_literals(cypher_query, cypher_params)
+    logger.info(f"Generated Cypher: {cypher_query} with params: {cypher_params}")
+    with driver.session() as session:
+        result = session.run(cypher_query, cypher_params)
+        # dict(record) keeps Path objects; Record.data() flattens them into node lists and loses each relationship's direction.
+        records = [dict(record) for record in islice(result, GRAPH_RESULT_LIMIT)]
+        # Discards whatever the server has not streamed yet instead of buffering it.
+        result.consume()
+    # Stored only once Neo4j accepted the query, so a broken reply is never replayed.
+    if cacheable:
+        _remember_cypher_reply(disk_cache, disk_key, reply)
+    return records
+
 def vector_search(query: str, query_meta: QueryMetadata) -> ToolResult:
     # ... (This function is unchanged) ...
     tool_name = "vector_search"; namespace = "pbac-text"
@@ -87,12 +373,15 @@ def vector_search(query: str, query_meta: QueryMetadata) -> ToolResult:
         if query_meta and query_meta.themes:
             metadata_filter["semantic_purpose"] = {"$in": query_meta.themes}
             logger.info(f"Applying metadata filter: {metadata_filter}")
+        cache_scope = _vector_cache_scope(namespace, query_meta)
+        cached, query_vector = _get_cached_vector_results(cache_scope, query)
+        if cached is not None:
+            return ToolResult(tool_name=tool_name, success=True, content=cached)
         try:
-            query_embedding = genai.embed_content(model='models/text-embedding-004', content=query, task_type="retrieval_query")
-            response = pinecone_index.query(namespace=namespace, vector=query_embedding['embedding'], top_k=10, include_metadata=True, filter=metadata_filter or None)
-            if not response.get('matches'): return ToolResult(tool_name=tool_name, success=True, content="")
-            content_list = _format_pinecone_results(response['matches'])
-            return ToolResult(tool_name=tool_name, success=True, content="\n---\n".join(content_list))
+            response = pinecone_index.query(namespace=namespace, vector=_get_query_embedding(query), top_k=10, include_metadata=True, filter=metadata_filter or None)
+            content = "\n---\n".join(_format_pinecone_results(response['matches'])) if response.get('matches') else ""
+            _put_cached_vector_results(cache_scope, query, query_vector, content)
+            return ToolResult(tool_name=tool_name, success=True, content=content)
         except Exception as e:
             logger.error(f"Error in vector search: {e}", exc_info=True)
             return ToolResult(tool_name=tool_name, success=False, content=f"An error occurred: {e}")
@@ -100,43 +389,32 @@ def vector_search(query: str, query_meta: QueryMetadata) -> ToolResult:
 def query_knowledge_graph(query: str, query_meta: QueryMetadata) -> ToolResult:
     tool_name = "query_knowledge_graph"
     with Timer(f"Tool: {tool_name}"):
+        if query_meta and not query_meta.question_is_graph_suitable:
+            return ToolResult(tool_name=tool_name, success=False, content="Query is not graph-suitable.")
         llm, driver = get_flash_model(), get_neo4j_driver()
         if not llm or not driver: return ToolResult(tool_name=tool_name, success=False, content="Clients not available.")
         try:
-            with driver.session() as session:
-                nodes_schema = session.run("CALL db.schema.nodeTypeProperties()").data()
-                rels_schema = session.run("CALL db.schema.relTypeProperties()").data()
-
-            schema_str = "Node Properties:\n"
-            for node in nodes_schema:
-                # --- START OF DEFINITIVE FIX ---
-                # The correct key for the property name is 'propertyName'.
-                prop_name = node['propertyName']
-                prop_type = node['propertyTypes'][0] # It's a list, take the first
-                schema_str += f"- Label: {node['nodeLabels'][0]}, Properties: {prop_name}: {prop_type}\n"
-                # --- END OF DEFINITIVE FIX ---
-            
-            schema_str += "\nRelationship Properties:\n"
-            for rel in rels_schema:
-                rel_type = rel.get('relType', '').strip('`')
-                properties = rel.get('properties', [])
-                props_list = [f"{p['property']}: {p['type']}" for p in properties]
-                props_str = ", ".join(props_list)
-                schema_str += f"- (:Entity)-[:{rel_type} {{{props_str}}}]->(:Entity)\n"
-
-            prompt = CYPHER_GENERATION_PROMPT.format(schema=schema_str, question=query)
-            response = llm.generate_content(prompt, request_options=DEFAULT_REQUEST_OPTIONS)
-            cypher_query = response.text.strip().replace("```cypher", "").replace("```", "")
-            
-            if "none" in cypher_query.lower() or "match" not in cypher_query.lower(): 
-                return ToolResult(tool_name=tool_name, success=True, content="")
-                
-            logger.info(f"Generated Cypher: {cypher_query}")
-            with driver.session() as session: records = session.run(cypher_query).data()
+            schema_str = _get_schema_string(driver)
+
+            examples_str = get_cypher_example_index().format_examples(query, intent=query_meta.intent if query_meta else None)
+            prompt = render_cypher_generation(examples=examples_str, schema=schema_str, question=query)
+            try:
+                records = _generate_and_run_cypher(llm, prompt, driver)
+            except (UnusableCypherError, neo4j.exceptions.CypherSyntaxError) as e:
+                # Flash handles most questions; only a broken query is escalated to the larger model.
+                fallback_llm = get_generative_model(CYPHER_FALLBACK_MODEL)
+                if not fallback_llm: raise
+                logger.warning(f"Flash Cypher generation failed ({e}). Retrying with '{CYPHER_FALLBACK_MODEL}'.")
+                try:
+                    records = _generate_and_run_cypher(fallback_llm, prompt, driver)
+                except UnusableCypherError as e:
+                    logger.warning(f"Fallback Cypher generation failed: {e}")
+                    records = []
             if not records: return ToolResult(tool_name=tool_name, success=True, content="")
             
             results = [_serialize_neo4j_path(record) for record in records if record.get("p")]
-            return ToolResult(tool_name=tool_name, success=True, content="\n".join(filter(None, results)))
+            # Same separator as vector_search, so every graph row reaches the agent as its own document.
+            return ToolResult(tool_name=tool_name, success=True, content="\n---\n".join(filter(None, results)))
         except Exception as e:
             logger.error(f"Error in KG tool: {e}", exc_info=True)
             return ToolResult(tool_name=tool_name, success=False, content=f"An error occurred: {e}")
\ No newline at end of file
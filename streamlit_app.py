@@ -1,5 +1,5 @@
 # FILE: streamlit_app.py
-# V3.1 (Definitive Fix): Corrected the agent call to be synchronous, fixing the asyncio ValueError.
+# V3.2 (Streaming): Renders the agent's answer incrementally as synthesis chunks arrive.
 
 import streamlit as st
 import logging
@@ -177,17 +177,20 @@ if prompt:
             with st.spinner(spinner_text):
                 history_for_rewrite = [f"{m['role']}: {m['content']}" for m in st.session_state.messages[-5:-1]]
                 
-                # --- START OF DEFINITIVE FIX ---
-                # REMOVED asyncio.run() as agent.run is now a synchronous function.
-                # This was the cause of the ValueError crash.
-                response = st.session_state.agent.run(
-                    prompt, 
+                # agent.run yields the answer in chunks; render them as they arrive.
+                # A manual placeholder is used instead of st.write_stream so the
+                # HTML citation links keep rendering with unsafe_allow_html.
+                answer_placeholder = st.empty()
+                response = ""
+                for chunk in st.session_state.agent.run(
+                    prompt,
                     persona=st.session_state.current_persona,
                     chat_history=history_for_rewrite
-                )
-                # --- END OF DEFINITIVE FIX ---
-                
-                st.markdown(response, unsafe_allow_html=True)
+                ):
+                    response += chunk
+                    answer_placeholder.markdown(response + "▌", unsafe_allow_html=True)
+
+                answer_placeholder.markdown(response, unsafe_allow_html=True)
                 st.session_state.messages.append({"role": "assistant", "content": response})
         else:
             st.error("Agent is not available due to an initialization error. Please check the terminal logs.")
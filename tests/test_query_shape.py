@@ -0,0 +1,29 @@
+from src.planner._query_shape import is_obviously_single_step, names_same_entities
+
+
+def test_single_subject_questions_skip_planning():
+    assert is_obviously_single_step("What is the PBAC outcome for Keytruda?")
+    assert is_obviously_single_step("who sponsors esketamine")
+
+
+def test_lowercase_multi_entity_questions_are_planned():
+    assert not is_obviously_single_step("keytruda or opdivo indications?")
+    assert not is_obviously_single_step("what do keytruda and opdivo treat")
+
+
+def test_comma_lists_are_planned():
+    assert not is_obviously_single_step("keytruda, opdivo or yervoy indications?")
+    assert not is_obviously_single_step("sponsors of keytruda, opdivo")
+
+
+def test_quantifiers_and_comparisons_are_planned():
+    assert not is_obviously_single_step("What is each drug's indication from the March meeting?")
+    assert not is_obviously_single_step("list all sponsors in July 2025")
+    assert not is_obviously_single_step("keytruda vs opdivo")
+
+
+def test_cached_keywords_must_match_the_new_query():
+    assert names_same_entities(["Keytruda"], "What was the PBAC outcome of keytruda?")
+    assert not names_same_entities(["Keytruda"], "What is the PBAC outcome for Opdivo?")
+    assert not names_same_entities(["Keytruda"], "PBAC outcome for Keytruda and Opdivo")
+    assert names_same_entities(["Janssen-Cilag Pty Ltd"], "drugs sponsored by janssen-cilag pty ltd")